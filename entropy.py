@@ -3,48 +3,17 @@
 # Henry Li
 
 import sys
-import gzip
 import math
 import argparse
 import os
-
-
-def read_fasta(filename):
-	"""Iteratively read records from a FASTA file"""
-	"""Stolen from the MCB185 library"""
-	try:
-		if filename == '-':
-			fp = sys.stdin
-		elif filename.endswith('.gz'):
-			fp = gzip.open(filename, 'rt')
-		else:
-			fp = open(filename)
-	except Exception as e:
-		sys.exit(f"Error opening file {filename}: {e}")
-
-	name = None
-	seqs = []
-	while True:
-		line = fp.readline()
-		if line == '':
-			break
-		line = line.rstrip()
-		if line.startswith('>'):
-			if len(seqs) > 0:
-				yield (name, ''.join(seqs))
-				name = line[1:]
-				seqs = []
-			else:
-				name = line[1:]
-		else:
-			seqs.append(line)
-	yield (name, ''.join(seqs))
-	fp.close()
+from seqio import read_fasta
+from twobit import read_twobit, iter_chunks, CHUNK_SIZE
+from gzio import open_output
 
 
 def entropy_of_seq(seq):
 	"""Calculate entropy of a given DNA seq"""
-	nts = 'ACGT'
+	nts = (b'A', b'C', b'G', b'T')
 	entropy = 0
 	for nt in nts:
 		p = seq.count(nt) / len(seq)
@@ -53,32 +22,51 @@ def entropy_of_seq(seq):
 	return entropy
 
 
-def mask_seq(seq, window_size, threshold, soft_mask=False):
+def mask_chunks(seq, window_size, threshold, soft_mask=False):
 	"""Perform masking of windows with entropy less than threshold"""
-	seq_list = list(seq)
-	for i in range(len(seq) - window_size + 1):
-		window_seq = seq[i:i + window_size]
-		entropy = entropy_of_seq(window_seq)
-		if entropy < threshold:
-			for j in range(i, i + window_size):
+	"""Yields the masked seq in pieces, a TwoBitSeq is decoded one chunk at a time"""
+	"""Entropy is always taken on the unmasked bases, as for a whole seq"""
+	tail = b''
+	for offset, chunk in iter_chunks(seq, window_size - 1):
+		seq_list = bytearray(chunk)
+		seq_list[:len(tail)] = tail
+		for i in range(len(chunk) - window_size + 1):
+			window_seq = chunk[i:i + window_size]
+			entropy = entropy_of_seq(window_seq)
+			if entropy < threshold:
 				if soft_mask:
-					seq_list[j] = seq_list[j].lower()
+					seq_list[i:i + window_size] = seq_list[i:i + window_size].lower()
 				else:
-					seq_list[j] = 'N'
-	return ''.join(seq_list)
+					seq_list[i:i + window_size] = b'N' * window_size
+		"""Bases past the chunk may be masked again by the next chunk's windows"""
+		done = min(len(seq_list), CHUNK_SIZE)
+		tail = bytes(seq_list[done:])
+		yield bytes(seq_list[:done])
+
+
+def mask_seq(seq, window_size, threshold, soft_mask=False):
+	"""Masked copy of a whole seq as bytes"""
+	return b''.join(mask_chunks(seq, window_size, threshold, soft_mask))
 
 
 def process_fasta_file(input_file, output_file, window_size, threshold, soft_mask):
 	"""Read in raw fasta file, output masked fasta file"""
 	try:
-		with open(output_file, 'w') as out_file:
-			for defline, seq in read_fasta(input_file):
-				masked_seq = mask_seq(seq, window_size, threshold, soft_mask)
-				out_file.write(f'>{defline}\n')
-				for i in range(0, len(masked_seq), 60):
-					out_file.write(masked_seq[i:i+60] + '\n')
+		with open_output(output_file, 'wb') as out_file:
+			if input_file.endswith('.2bit'):
+				records = read_twobit(input_file)
+			else:
+				records = read_fasta(input_file)
+			for defline, seq in records:
+				out_file.write(f'>{defline}\n'.encode())
+				"""Chunks are whole 60 base lines except the last"""
+				for masked_seq in mask_chunks(seq, window_size, threshold, soft_mask):
+					for i in range(0, len(masked_seq), 60):
+						out_file.write(masked_seq[i:i+60] + b'\n')
+	except ValueError:
+		raise
 	except Exception as e:
-		sys.exit(f"Error processing FASTA file {input_file}: {e}")
+		raise IOError(f"Error processing FASTA file {input_file}: {e}") from e
 
 
 def main():
@@ -87,7 +75,7 @@ def main():
 		description='Entropy filter for DNA sequences.',
 		formatter_class=argparse.RawTextHelpFormatter)
 	parser.add_argument('input_file',
-						help='Input FASTA file')
+						help='Input FASTA or .2bit file')
 	parser.add_argument('-o', '--output',
 						help=('Output FASTA file, file name length < 256\n'
 							  'Default = [input_file_basename].masked.fasta'))
@@ -112,9 +100,9 @@ def main():
 	if not os.path.exists(args.input_file):
 		sys.exit(f"Error: Input file {args.input_file} does not exist.")
 
-	if not args.input_file.endswith('.fasta') and not args.input_file.endswith('.fasta.gz') and not args.input_file.endswith('.fa') and not args.input_file.endswith('.fa.gz'):
+	if not args.input_file.endswith('.fasta') and not args.input_file.endswith('.fasta.gz') and not args.input_file.endswith('.fa') and not args.input_file.endswith('.fa.gz') and not args.input_file.endswith('.2bit'):
 		sys.exit(
-			"Error: Input file type error.\nFile type fasta/fa/fasta.gz/fa.gz expected.")
+			"Error: Input file type error.\nFile type fasta/fa/fasta.gz/fa.gz/2bit expected.")
 
 	"""Format outfile name"""
 	if args.output:
@@ -126,8 +114,11 @@ def main():
 		output_file = os.path.splitext(args.input_file)[0] + '.masked.fasta'
 
 	"""Code body"""
-	process_fasta_file(args.input_file, output_file,
-					   args.window_size, args.threshold, args.soft_mask)
+	try:
+		process_fasta_file(args.input_file, output_file,
+						   args.window_size, args.threshold, args.soft_mask)
+	except (IOError, ValueError) as e:
+		sys.exit(str(e))
 
 
 if __name__ == '__main__':
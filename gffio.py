@@ -0,0 +1,81 @@
+# GFF reading and feature filters shared by the overlap tools
+# Henry Li
+
+from gzio import open_input
+
+
+def parse_region(region):
+	"""Turn chr or chr:beg-end into a (chrom, beg, end) tuple"""
+	if region is None:
+		return None
+	chrom, _, span = region.partition(':')
+	if not span:
+		return (chrom, None, None)
+	try:
+		beg, end = span.replace(',', '').split('-')
+		return (chrom, int(beg), int(end))
+	except ValueError:
+		raise ValueError(f"Error: Region {region} format error.\nchr or chr:beg-end expected.")
+
+
+def iter_gff(filename, feature_type=None, strand=None, source=None, region=None):
+	"""Iteratively read features from a GFF file"""
+	"""Filters are checked before the full split and int conversion"""
+	fp = open_input(filename)
+
+	if region:
+		region_chrom, region_beg, region_end = region
+	else:
+		region_chrom = None
+
+	for line in fp:
+		if line.startswith('#'):
+			continue
+		"""Cheap substring rejects before any splitting"""
+		if region_chrom and not line.startswith(region_chrom):
+			continue
+		if feature_type and feature_type not in line:
+			continue
+		cols = line.split(None, 7)
+		if len(cols) < 8:
+			continue
+		if region_chrom and cols[0] != region_chrom:
+			continue
+		if feature_type and cols[2] != feature_type:
+			continue
+		if source and cols[1] != source:
+			continue
+		if strand and cols[6] != strand:
+			continue
+		start = int(cols[3])
+		end = int(cols[4])
+		if region_chrom and region_beg is not None:
+			if start > region_end or end < region_beg:
+				continue
+		rest = cols[7].split()
+		if len(rest) < 2:
+			continue
+		yield {
+			"chrom": cols[0],
+			"source": cols[1],
+			"feature_type": cols[2],
+			"start": start,
+			"end": end,
+			"score": cols[5],
+			"strand": cols[6],
+			"frame": rest[0],
+			"attribute": rest[1]
+		}
+
+	fp.close()
+
+
+def read_gff(filename, feature_type=None, strand=None, source=None, region=None):
+	"""Store features to dictionary by chromosome from a GFF file"""
+	features = {}
+	for feature_info in iter_gff(filename, feature_type, strand, source, region):
+		chrom = feature_info["chrom"]
+		if chrom not in features:
+			features[chrom] = []
+		features[chrom].append(feature_info)
+	return features
@@ -0,0 +1,245 @@
+# Threaded gzip input and block-parallel BGZF output shared by the tools
+# Henry Li
+
+import io
+import os
+import gzip
+import zlib
+import queue
+import struct
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+THREADS = os.cpu_count() or 1
+BLOCK_SIZE = 1 << 20
+READ_AHEAD = 16
+
+"""BGZF blocks hold at most 64 KB, this leaves room for the deflate overhead"""
+BGZF_BLOCK_SIZE = 65280
+BGZF_HEADER = struct.Struct('<4BI2BH2BHH')
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+def is_bgzf(fp):
+	"""Check the first header of a seekable binary file for the BGZF BC subfield"""
+	head = fp.read(BGZF_HEADER.size)
+	fp.seek(0)
+	if len(head) < BGZF_HEADER.size:
+		return False
+	id1, id2, cm, flg, _, _, _, xlen, si1, si2, slen, _ = BGZF_HEADER.unpack(head)
+	return (id1, id2, cm) == (31, 139, 8) and flg & 4 and si1 == 66 and si2 == 67 and slen == 2
+
+
+def _inflate_block(block):
+	"""Decompress one BGZF block and check its CRC"""
+	cdata, crc, isize = block
+	try:
+		data = zlib.decompress(cdata, -15)
+	except zlib.error as e:
+		raise IOError(f"Corrupt BGZF block: {e}") from e
+	if len(data) != isize or zlib.crc32(data) != crc:
+		raise IOError("BGZF block failed its CRC check")
+	return data
+
+
+def _read_bgzf_block(fp):
+	"""Read the next raw BGZF block as (cdata, crc, isize), None at EOF"""
+	head = fp.read(12)
+	if not head:
+		return None
+	if len(head) < 12 or head[:2] != b'\x1f\x8b':
+		raise IOError("Truncated or invalid BGZF block")
+	xlen = struct.unpack('<H', head[10:12])[0]
+	extra = fp.read(xlen)
+	if len(extra) < xlen:
+		raise IOError("Truncated BGZF block")
+	bsize = None
+	pos = 0
+	while pos + 4 <= len(extra):
+		slen = struct.unpack('<H', extra[pos + 2:pos + 4])[0]
+		if extra[pos:pos + 2] == b'BC' and slen == 2:
+			bsize = struct.unpack('<H', extra[pos + 4:pos + 6])[0]
+		pos += 4 + slen
+	if bsize is None:
+		raise IOError("gzip member without a BGZF block size")
+	rest = fp.read(bsize + 1 - 12 - xlen)
+	if len(rest) != bsize + 1 - 12 - xlen or len(rest) < 8:
+		raise IOError("Truncated BGZF block")
+	crc, isize = struct.unpack('<II', rest[-8:])
+	return (rest[:-8], crc, isize)
+
+
+def bgzf_blocks(fp, threads=THREADS):
+	"""Yield decompressed BGZF blocks, inflated in parallel and kept in order"""
+	with ThreadPoolExecutor(threads) as pool:
+		while True:
+			batch = []
+			for _ in range(threads * 8):
+				block = _read_bgzf_block(fp)
+				if block is None:
+					break
+				batch.append(block)
+			if not batch:
+				break
+			for data in pool.map(_inflate_block, batch):
+				if data:
+					yield data
+
+
+def gzip_blocks(fp):
+	"""Yield decompressed blocks from any gzip stream, members included"""
+	with gzip.GzipFile(fileobj=fp) as gz:
+		while True:
+			block = gz.read(BLOCK_SIZE)
+			if not block:
+				break
+			yield block
+
+
+class ReadAheadRaw(io.RawIOBase):
+	"""Raw reader fed by a background thread through a bounded queue"""
+	"""zlib releases the GIL, so inflation overlaps with parsing"""
+
+	def __init__(self, fp, threads=THREADS):
+		super().__init__()
+		self._fp = fp
+		self._name = getattr(fp, 'name', '<stream>')
+		self._queue = queue.Queue(READ_AHEAD)
+		self._stop = threading.Event()
+		self._block = memoryview(b'')
+		self._done = False
+		if is_bgzf(fp):
+			source = bgzf_blocks(fp, threads)
+		else:
+			source = gzip_blocks(fp)
+		self._thread = threading.Thread(target=self._fill, args=(source,), daemon=True)
+		self._thread.start()
+
+	def _put(self, item):
+		while not self._stop.is_set():
+			try:
+				self._queue.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				continue
+		return False
+
+	def _fill(self, source):
+		try:
+			for block in source:
+				if not self._put(block):
+					return
+			self._put(None)
+		except (EOFError, zlib.error) as e:
+			"""Truncated or corrupt plain gzip, reported like other read errors"""
+			self._put(IOError(f"Error reading file {self._name}: Corrupt or truncated gzip input: {e}"))
+		except IOError as e:
+			self._put(IOError(f"Error reading file {self._name}: {e}"))
+		except Exception as e:
+			self._put(e)
+		finally:
+			source.close()
+
+	def readable(self):
+		return True
+
+	def readinto(self, b):
+		while not self._block and not self._done:
+			item = self._queue.get()
+			if item is None:
+				self._done = True
+			elif isinstance(item, Exception):
+				self._done = True
+				raise item
+			else:
+				self._block = memoryview(item)
+		n = min(len(b), len(self._block))
+		b[:n] = self._block[:n]
+		self._block = self._block[n:]
+		return n
+
+	def close(self):
+		if not self.closed:
+			self._stop.set()
+			self._thread.join()
+			self._fp.close()
+		super().close()
+
+
+class BgzfWriter(io.RawIOBase):
+	"""Raw writer that deflates BGZF blocks on a thread pool"""
+	"""The output is ordinary multi-member gzip that zcat and gzip read"""
+
+	def __init__(self, fp, level=6, threads=THREADS):
+		super().__init__()
+		self._fp = fp
+		self._level = level
+		self._threads = threads
+		self._pool = ThreadPoolExecutor(threads)
+		self._pending = deque()
+		self._buf = bytearray()
+
+	def writable(self):
+		return True
+
+	def write(self, b):
+		self._buf += b
+		while len(self._buf) >= BGZF_BLOCK_SIZE:
+			self._submit(bytes(self._buf[:BGZF_BLOCK_SIZE]))
+			del self._buf[:BGZF_BLOCK_SIZE]
+		return len(b)
+
+	def _submit(self, data):
+		self._pending.append(self._pool.submit(deflate_block, data, self._level))
+		while len(self._pending) > self._threads * 4:
+			self._fp.write(self._pending.popleft().result())
+
+	def close(self):
+		if not self.closed:
+			if self._buf:
+				self._submit(bytes(self._buf))
+				self._buf = bytearray()
+			while self._pending:
+				self._fp.write(self._pending.popleft().result())
+			self._fp.write(BGZF_EOF)
+			self._pool.shutdown()
+			self._fp.close()
+		super().close()
+
+
+def deflate_block(data, level=6):
+	"""Compress up to BGZF_BLOCK_SIZE bytes into one BGZF block"""
+	comp = zlib.compressobj(level, zlib.DEFLATED, -15)
+	cdata = comp.compress(data) + comp.flush()
+	header = BGZF_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2,
+							  len(cdata) + BGZF_HEADER.size + 8 - 1)
+	return header + cdata + struct.pack('<II', zlib.crc32(data), len(data))
+
+
+def open_input(filename, mode='rt', threads=THREADS):
+	"""Open a file for reading, .gz files are inflated in the background"""
+	try:
+		if not filename.endswith('.gz'):
+			return open(filename, mode)
+		raw = ReadAheadRaw(open(filename, 'rb'), threads)
+	except Exception as e:
+		raise IOError(f"Error opening file {filename}: {e}") from e
+	buffered = io.BufferedReader(raw, BLOCK_SIZE)
+	if 'b' in mode:
+		return buffered
+	return io.TextIOWrapper(buffered)
+
+
+def open_output(filename, mode='wt', level=6, threads=THREADS):
+	"""Open a file for writing, .gz files are BGZF compressed in parallel"""
+	try:
+		if not filename.endswith('.gz'):
+			return open(filename, mode)
+		raw = BgzfWriter(open(filename, 'wb'), level, threads)
+	except Exception as e:
+		raise IOError(f"Error opening file {filename}: {e}") from e
+	buffered = io.BufferedWriter(raw, BLOCK_SIZE)
+	if 'b' in mode:
+		return buffered
+	return io.TextIOWrapper(buffered)
@@ -0,0 +1,108 @@
+# Per-stage timing and memory records shared by the GFF overlap tools
+# Henry Li
+
+import sys
+import json
+import time
+import cProfile
+import resource
+from contextlib import contextmanager
+
+
+def _status_kb(field):
+	"""Read a memory field such as VmRSS from /proc/self/status, None if missing"""
+	try:
+		with open('/proc/self/status') as fp:
+			for line in fp:
+				if line.startswith(field + ':'):
+					return int(line.split()[1])
+	except (IOError, ValueError):
+		pass
+	return None
+
+
+def _reset_peak_rss():
+	"""Reset the kernel's peak RSS mark (Linux 4.0+), False where unsupported"""
+	try:
+		with open('/proc/self/clear_refs', 'w') as fp:
+			fp.write('5')
+		return True
+	except IOError:
+		return False
+
+
+class Profiler:
+	"""Collect wall time, CPU time, peak RSS and counts for named stages"""
+	"""The peak is reset at each stage start where the kernel allows it,"""
+	"""otherwise peak_rss_kb is the process peak so far"""
+	"""Records are written as JSON lines when enabled, otherwise dropped"""
+
+	def __init__(self, enabled=False, output='-', cprofile_file=None):
+		"""output is a file name, '-' for stderr, or None to only keep records"""
+		self.enabled = enabled
+		self.records = []
+		self.cprofile_file = cprofile_file
+		self._cprofile = None
+		self._fp = None
+		if enabled and output == '-':
+			self._fp = sys.stderr
+		elif enabled and output is not None:
+			try:
+				self._fp = open(output, 'w')
+			except IOError as e:
+				raise IOError(f"Error opening profile file {output}: {e}") from e
+		if cprofile_file:
+			self._cprofile = cProfile.Profile()
+			self._cprofile.enable()
+
+	@contextmanager
+	def stage(self, name, **fields):
+		"""Time a block, the yielded dict can be filled with item counts"""
+		record = {"stage": name}
+		record.update(fields)
+		if not self.enabled:
+			yield record
+			return
+		rss_start = _status_kb('VmRSS')
+		stage_peak = _reset_peak_rss()
+		wall_start = time.perf_counter()
+		cpu_start = time.process_time()
+		yield record
+		record["wall"] = time.perf_counter() - wall_start
+		record["cpu"] = time.process_time() - cpu_start
+		peak = _status_kb('VmHWM')
+		if peak is None:
+			peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+			stage_peak = False
+		rss_end = _status_kb('VmRSS')
+		record["peak_rss_kb"] = peak
+		record["peak_scope"] = "stage" if stage_peak else "process"
+		if rss_start is not None and rss_end is not None:
+			record["rss_delta_kb"] = rss_end - rss_start
+		self.emit(record)
+
+	def event(self, name, **fields):
+		"""Record counts that are not tied to a timed block"""
+		if self.enabled:
+			record = {"stage": name}
+			record.update(fields)
+			self.emit(record)
+
+	def emit(self, record):
+		"""Write one record, also used to forward records from workers"""
+		if not self.enabled:
+			return
+		self.records.append(record)
+		if self._fp is not None:
+			self._fp.write(json.dumps(record) + '\n')
+			self._fp.flush()
+
+	def close(self):
+		"""Stop cProfile and dump its stats, then close the record file"""
+		if self._cprofile is not None:
+			self._cprofile.disable()
+			self._cprofile.dump_stats(self.cprofile_file)
+			self._cprofile = None
+		if self._fp is not None and self._fp is not sys.stderr:
+			self._fp.close()
+		self._fp = None
@@ -4,62 +4,30 @@
 
 import argparse
 import sys
-import gzip
 import json
 import os
-
-
-def read_gbff(filename):
-	"""Read info and join seq from a GBFF file"""
-	try:
-		if filename == '-':
-			fp = sys.stdin
-		elif filename.endswith('.gz'):
-			fp = gzip.open(filename, 'rt')
-		else:
-			fp = open(filename)
-	except Exception as e:
-		sys.exit(f"Error opening file {filename}: {e}")
-
-	info = []
-	seqs = []
-	origin_found = False
-
-	while True:
-		line = fp.readline()
-		if line == '':
-			sys.exit(f"Error: Input file format error.")
-		line = line.rstrip()
-		if 'ORIGIN' in line:
-			origin_found = True
-		if origin_found:
-			if '//' in line:
-				yield (info, ''.join(seqs))
-				break
-			seqs.append(''.join(line.split()[1:]))
-		else:
-			info.append(line)
-	yield (info, ''.join(seqs))
-
-	fp.close()
+from seqio import read_gbff
+from twobit import read_twobit_gbff
 
 
 def anti_seq(seq):
 	"""Get the reverse-complement of a sequence"""
-	comp = str.maketrans('ACGTRYMKWSBDHVacgtrymkwsbdhv',
-						 'TGCAYRKMWSVHDBtgcayrkmwsvhdb')
+	comp = bytes.maketrans(b'ACGTRYMKWSBDHVacgtrymkwsbdhv',
+						   b'TGCAYRKMWSVHDBtgcayrkmwsvhdb')
 	anti = seq.translate(comp)[::-1]
 	return anti
 
 
-def create_pwm(info, seq, by_nucleotide):
+def create_pwm(info, seq, by_nucleotide, pwm=None):
 	"""Creates the pwm from CDS features"""
-	if by_nucleotide:
-		pwm = {'A': [0] * 14, 'C': [0] * 14, 'G': [0] * 14, 'T': [0] * 14}
-	else:
-		pwm = []
-		for _ in range(14):
-			pwm.append({'A': 0, 'C': 0, 'G': 0, 'T': 0})
+	"""Counts are added to pwm when given, so records can share one pwm"""
+	if pwm is None:
+		if by_nucleotide:
+			pwm = {'A': [0] * 14, 'C': [0] * 14, 'G': [0] * 14, 'T': [0] * 14}
+		else:
+			pwm = []
+			for _ in range(14):
+				pwm.append({'A': 0, 'C': 0, 'G': 0, 'T': 0})
 
 	for line in info:
 		if line.startswith('     CDS'):
@@ -78,11 +46,11 @@ def create_pwm(info, seq, by_nucleotide):
 			if len(kozak) != 14:
 				continue
 
-			for pos, nt in enumerate(kozak):
+			for pos, nt in enumerate(kozak.upper().decode()):
 				if by_nucleotide:
-					pwm[nt.upper()][pos] += 1
+					pwm[nt][pos] += 1
 				else:
-					pwm[pos][nt.upper()] += 1
+					pwm[pos][nt] += 1
 
 	return pwm
 
@@ -93,7 +61,7 @@ def pwm_to_json(pwm, output_file):
 		with open(output_file, 'w') as out_file:
 			json.dump(pwm, out_file, indent=4)
 	except IOError as e:
-		sys.exit(f"Error writing to output file {output_file}: {e}")
+		raise IOError(f"Error writing to output file {output_file}: {e}") from e
 
 
 def main():
@@ -103,7 +71,7 @@ def main():
 		formatter_class=argparse.RawTextHelpFormatter)
 	parser.add_argument('input_file',
 						help=('Input GBFF file\n'
-							  'Accept .gbff or .gbff.gz'))
+							  'Accept .gbff, .gbff.gz or .2bit made from GBFF'))
 	parser.add_argument('-o', '--output',
 						help=('Output JSON file, file name length < 256\n'
 							  'Default = [input_file_basename].pwm.json'))
@@ -118,8 +86,8 @@ def main():
 	if not os.path.exists(args.input_file):
 		sys.exit(f"Error: Input file {args.input_file} does not exist.")
 
-	if not args.input_file.endswith('.gbff') and not args.input_file.endswith('.gbff.gz'):
-		sys.exit("Error: Input file type error.\nFile type gbff/gbff.gz expected.")
+	if not args.input_file.endswith('.gbff') and not args.input_file.endswith('.gbff.gz') and not args.input_file.endswith('.2bit'):
+		sys.exit("Error: Input file type error.\nFile type gbff/gbff.gz/2bit expected.")
 
 	"""Format outfile name"""
 	if args.output:
@@ -131,9 +99,17 @@ def main():
 		output_file = os.path.splitext(args.input_file)[0] + ".pwm.json"
 
 	"""Code body"""
-	for info, seq in read_gbff(args.input_file):
-		pwm = create_pwm(info, seq, args.by_nucleotide)
+	try:
+		if args.input_file.endswith('.2bit'):
+			records = read_twobit_gbff(args.input_file)
+		else:
+			records = read_gbff(args.input_file)
+		pwm = None
+		for info, seq in records:
+			pwm = create_pwm(info, seq, args.by_nucleotide, pwm)
 		pwm_to_json(pwm, output_file)
+	except (IOError, ValueError) as e:
+		sys.exit(str(e))
 
 
 if __name__ == '__main__':
@@ -4,84 +4,51 @@
 
 import argparse
 import sys
-import gzip
 import os
-
-
-def read_fasta(filename):
-	"""Iteratively read records from a FASTA file"""
-	"""'Borrowed' from the MCB185 library"""
-	try:
-		if filename == '-':
-			fp = sys.stdin
-		elif filename.endswith('.gz'):
-			fp = gzip.open(filename, 'rt')
-		else:
-			fp = open(filename)
-	except Exception as e:
-		sys.exit(f"Error opening file {filename}: {e}")
-
-	name = None
-	seqs = []
-	while True:
-		line = fp.readline()
-		if line == '':
-			break
-		line = line.rstrip()
-		if line.startswith('>'):
-			if len(seqs) > 0:
-				yield (name, ''.join(seqs))
-				name = line[1:]
-				seqs = []
-			else:
-				name = line[1:]
-		else:
-			seqs.append(line)
-	yield (name, ''.join(seqs))
-	fp.close()
+from seqio import read_fasta
+from twobit import read_twobit, iter_chunks
 
 
 def anti_seq(seq):
 	"""Get the reverse-complement of a sequence"""
-	comp = str.maketrans('ACGTRYMKWSBDHVacgtrymkwsbdhv',
-						 'TGCAYRKMWSVHDBtgcayrkmwsvhdb')
+	comp = bytes.maketrans(b'ACGTRYMKWSBDHVacgtrymkwsbdhv',
+						   b'TGCAYRKMWSVHDBtgcayrkmwsvhdb')
 	anti = seq.translate(comp)[::-1]
 	return anti
 
 
-def find_kmers(seq, kmer_size):
+def find_kmers(seq, kmer_size, kmers=None, offset=0, sign=1):
 	"""Stores all found kmers and indices on a given seq"""
-	kmers = {}
-	if len(seq) < kmer_size:
-		return kmers
-
-	kmer = seq[:kmer_size]
-	if kmer not in kmers:
-		kmers[kmer] = []
-	kmers[kmer].append(1)
-
-	for i in range(1, len(seq) - kmer_size + 1):
-		kmer = kmer[1:] + seq[i + kmer_size - 1]
+	"""A chunk of a longer seq adds to kmers, positions shifted by offset"""
+	"""and multiplied by sign, which is -1 for the reverse strand"""
+	seq = bytes(seq)
+	if kmers is None:
+		kmers = {}
+
+	for i in range(len(seq) - kmer_size + 1):
+		kmer = seq[i:i + kmer_size]
 		if kmer not in kmers:
 			kmers[kmer] = []
-		kmers[kmer].append(i + 1)
+		kmers[kmer].append(sign * (offset + i + 1))
 
 	return kmers
 
 
 def process_fasta_file(input_file, kmer_size, both_strands):
 	"""Reads fasta and finds all kmers and indices"""
-	for defline, seq in read_fasta(input_file):
-		kmers = find_kmers(seq, kmer_size)
+	"""Sequences are scanned in chunks so a .2bit is never decoded whole"""
+	if input_file.endswith('.2bit'):
+		records = read_twobit(input_file)
+	else:
+		records = read_fasta(input_file)
+	for defline, seq in records:
+		kmers = {}
+		for offset, chunk in iter_chunks(seq, kmer_size - 1):
+			find_kmers(chunk, kmer_size, kmers, offset)
 		"""Includes rev seq if both_strands = True"""
 		if both_strands:
-			rev_seq = anti_seq(seq)
-			kmers_rev = find_kmers(rev_seq, kmer_size)
-			for kmer, positions in kmers_rev.items():
-				if kmer not in kmers:
-					kmers[kmer] = []
-				for p in positions:
-					kmers[kmer].append(-int(p))
+			for offset, chunk in iter_chunks(seq, kmer_size - 1, reverse=True):
+				find_kmers(chunk, kmer_size, kmers, offset, -1)
 		return kmers
 
 
@@ -90,7 +57,7 @@ def main():
 	parser = argparse.ArgumentParser(
 		description='Find k-mer locations in a DNA sequence.',
 		formatter_class=argparse.RawTextHelpFormatter)
-	parser.add_argument('input_file', help='Input FASTA file')
+	parser.add_argument('input_file', help='Input FASTA or .2bit file')
 	parser.add_argument('-k', "--kmer_size",
 						type=int,
 						default=3,
@@ -106,18 +73,21 @@ def main():
 	if not os.path.exists(args.input_file):
 		sys.exit(f"Error: Input file {args.input_file} does not exist.")
 
-	if not args.input_file.endswith('.fasta') and not args.input_file.endswith('.fasta.gz') and not args.input_file.endswith('.fa') and not args.input_file.endswith('.fa.gz'):
+	if not args.input_file.endswith('.fasta') and not args.input_file.endswith('.fasta.gz') and not args.input_file.endswith('.fa') and not args.input_file.endswith('.fa.gz') and not args.input_file.endswith('.2bit'):
 		sys.exit(
-			"Error: Input file type error.\nFile type fasta/fa/fasta.gz/fa.gz expected.")
+			"Error: Input file type error.\nFile type fasta/fa/fasta.gz/fa.gz/2bit expected.")
 
 	"""Code body"""
-	kmer_locations = process_fasta_file(
-		args.input_file, args.kmer_size, args.both_strands)
-	for kmer, positions in sorted(kmer_locations.items()):
-		position_all = ''
-		for pos in positions:
-			position_all += (str(pos) + " ")
-		print(f"{kmer} {position_all}")
+	try:
+		kmer_locations = process_fasta_file(
+			args.input_file, args.kmer_size, args.both_strands)
+		for kmer, positions in sorted(kmer_locations.items()):
+			position_all = ''
+			for pos in positions:
+				position_all += (str(pos) + " ")
+			print(f"{kmer.decode()} {position_all}")
+	except (IOError, ValueError) as e:
+		sys.exit(str(e))
 
 
 if __name__ == '__main__':
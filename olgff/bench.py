@@ -0,0 +1,287 @@
+#! /usr/bin/env python
+# Benchmark GFF overlap engines on generated inputs
+# Henry Li
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import runpy
+import statistics
+import sys
+import time
+from mkgff import PROFILES
+
+
+OLGFF_DIR = os.path.dirname(os.path.abspath(__file__))
+MKGFF = os.path.join(OLGFF_DIR, 'mkgff.py')
+OLGFF = os.path.join(OLGFF_DIR, 'olgff.py')
+OVERLAP = os.path.join(os.path.dirname(OLGFF_DIR), 'overlap.py')
+
+"""Seeds for the first and second input of every generated case"""
+CASE_SEEDS = (1, 2)
+
+FIELDS = ['case', 'engine', 'zones', 'repeats', 'median', 'iqr',
+		  'min', 'max', 'peak_rss_kb', 'rows']
+
+
+def run_script(path, argv):
+	"""Run a command line script in this process with its output discarded"""
+	sys.argv = [path] + argv
+	"""Scripts expect their own directory on the path, as when run directly"""
+	script_dir = os.path.dirname(path)
+	if script_dir not in sys.path:
+		sys.path.insert(0, script_dir)
+	with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+		runpy.run_path(path, run_name='__main__')
+
+
+def overlap_engine(gff1, gff2, output, zones):
+	"""Bisect index engine, zones are ignored"""
+	run_script(OVERLAP, [gff1, gff2, '-o', output])
+
+
+def olgff_engine(gff1, gff2, output, zones):
+	"""Zone based engine"""
+	run_script(OLGFF, [gff1, gff2, '-z', str(zones), '-o', output])
+
+
+"""Engines to benchmark, zoned engines are run once per zone count"""
+ENGINES = {
+	'overlap': {'run': overlap_engine, 'zoned': False},
+	'olgff': {'run': olgff_engine, 'zoned': True},
+}
+
+
+def case_length(profile, numl):
+	"""Chromosome length that keeps the profile's feature density at numl lines"""
+	defaults = PROFILES[profile]
+	return max(defaults['length'], -(-numl * defaults['length'] // defaults['numl']))
+
+
+def generate_case(profile, numl, workdir):
+	"""Write both inputs for one profile with mkgff, reusing existing files"""
+	length = case_length(profile, numl)
+	gffs = []
+	for seed in CASE_SEEDS:
+		filename = os.path.join(workdir, f"{profile}.{numl}.{seed}.gff")
+		if not os.path.exists(filename):
+			try:
+				run_script(MKGFF, ['--profile', profile, '-n', str(numl), '--length', str(length),
+								   '-s', str(seed), '-o', filename])
+			except SystemExit as e:
+				if os.path.exists(filename):
+					os.remove(filename)
+				sys.exit(f"Error: mkgff failed for case {profile}.{numl} seed {seed} (exit code {e.code}).")
+		gffs.append(filename)
+	return gffs
+
+
+def _timed_child(conn, engine, gff1, gff2, output, zones):
+	"""Run one engine call in a forked child and report time and peak RSS"""
+	start_time = time.perf_counter()
+	ENGINES[engine]['run'](gff1, gff2, output, zones)
+	wall = time.perf_counter() - start_time
+	conn.send((wall, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+	conn.close()
+
+
+def timed_run(engine, gff1, gff2, output, zones):
+	"""Fork so that each run starts clean and has its own peak RSS"""
+	ctx = multiprocessing.get_context('fork')
+	parent_conn, child_conn = ctx.Pipe(duplex=False)
+	proc = ctx.Process(target=_timed_child,
+					   args=(child_conn, engine, gff1, gff2, output, zones))
+	proc.start()
+	child_conn.close()
+	try:
+		wall, rss = parent_conn.recv()
+	except EOFError:
+		proc.join()
+		sys.exit(f"Error: {engine} failed on {gff1} {gff2} (exit code {proc.exitcode}).")
+	proc.join()
+	return wall, rss
+
+
+def count_rows(filename):
+	"""Number of overlaps in an output TSV, header excluded"""
+	with open(filename) as fp:
+		return max(0, sum(1 for _ in fp) - 1)
+
+
+def benchmark(case, gff1, gff2, engine, zones, warmup, repeats, workdir):
+	"""Time one engine on one case and summarise the repeats"""
+	output = os.path.join(workdir, f"{case}.{engine}.{zones}.tsv")
+	for _ in range(warmup):
+		timed_run(engine, gff1, gff2, output, zones)
+	times = []
+	peak_rss = 0
+	for _ in range(repeats):
+		wall, rss = timed_run(engine, gff1, gff2, output, zones)
+		times.append(wall)
+		peak_rss = max(peak_rss, rss)
+	if repeats > 1:
+		q1, _, q3 = statistics.quantiles(times, n=4)
+		iqr = q3 - q1
+	else:
+		iqr = 0.0
+	return {
+		"case": case,
+		"engine": engine,
+		"zones": zones,
+		"repeats": repeats,
+		"median": statistics.median(times),
+		"iqr": iqr,
+		"min": min(times),
+		"max": max(times),
+		"peak_rss_kb": peak_rss,
+		"rows": count_rows(output)
+	}
+
+
+def result_key(result):
+	"""Identify a measurement across result files"""
+	return (result['case'], result['engine'], result['zones'])
+
+
+def check_rows(results):
+	"""Warn when engines disagree on the number of overlaps for a case"""
+	rows_by_case = {}
+	for result in results:
+		rows_by_case.setdefault(result['case'], set()).add(result['rows'])
+	for case, rows in rows_by_case.items():
+		if len(rows) > 1:
+			print(f"Warning: engines disagree on row counts for {case}: {sorted(rows)}")
+
+
+def check_regressions(results, baseline_file, tolerance):
+	"""Compare medians against a saved baseline, returns failing keys"""
+	try:
+		with open(baseline_file) as fp:
+			baseline = {result_key(r): r for r in json.load(fp)}
+	except (IOError, ValueError) as e:
+		sys.exit(f"Error reading baseline file {baseline_file}: {e}")
+
+	regressions = []
+	for result in results:
+		key = result_key(result)
+		if key not in baseline:
+			continue
+		limit = baseline[key]['median'] * (1 + tolerance)
+		if result['median'] > limit:
+			regressions.append(key)
+			print(f"Regression: {key[0]} {key[1]} zones={key[2]} "
+				  f"{result['median']:.4f}s > {limit:.4f}s")
+	return regressions
+
+
+def write_json(results, output_file):
+	"""Outputs to JSON"""
+	with open(output_file, 'w') as fp:
+		json.dump(results, fp, indent=4)
+
+
+def write_tsv(results, output_file):
+	"""Outputs to TSV, one measurement per line"""
+	with open(output_file, 'w') as fp:
+		fp.write('\t'.join(FIELDS) + '\n')
+		for result in results:
+			fp.write('\t'.join(str(result[f]) for f in FIELDS) + '\n')
+
+
+def main():
+	"""argparse statements"""
+	parser = argparse.ArgumentParser(
+		description='Benchmark GFF overlap engines on generated inputs.',
+		formatter_class=argparse.RawTextHelpFormatter)
+	parser.add_argument('--profiles', nargs='+', default=['uniform'],
+						choices=list(PROFILES),
+						help=('mkgff profiles to generate inputs from\n'
+							  'Default = uniform'))
+	parser.add_argument('-n', '--numl', type=int, default=10000,
+						help=('Number of lines in each generated input\n'
+							  'Default = 10000'))
+	parser.add_argument('-i', '--inputs', nargs=2, action='append', default=[],
+						metavar=('GFF1', 'GFF2'),
+						help='Existing GFF pair to benchmark, may be repeated')
+	parser.add_argument('-e', '--engines', nargs='+', default=list(ENGINES),
+						choices=list(ENGINES),
+						help=('Engines to run\n'
+							  'Default = all'))
+	parser.add_argument('-z', '--zones', type=int, nargs='+', default=[1, 5, 10],
+						help=('Zone counts for zoned engines\n'
+							  'Default = 1 5 10'))
+	parser.add_argument('-w', '--warmup', type=int, default=1,
+						help=('Untimed runs before measuring\n'
+							  'Default = 1'))
+	parser.add_argument('-r', '--repeats', type=int, default=5,
+						help=('Timed runs per measurement\n'
+							  'Default = 5'))
+	parser.add_argument('-d', '--workdir', default='bench',
+						help=('Directory for generated inputs and outputs\n'
+							  'Default = bench'))
+	parser.add_argument('-j', '--json',
+						help='Write results to this JSON file')
+	parser.add_argument('-t', '--tsv',
+						help='Write results to this TSV file')
+	parser.add_argument('-b', '--baseline',
+						help='JSON results to compare against, exit 1 on regression')
+	parser.add_argument('--tolerance', type=float, default=0.1,
+						help=('Allowed slowdown over the baseline median\n'
+							  'Default = 0.1'))
+
+	args = parser.parse_args()
+
+	if args.repeats < 1:
+		parser.error("The number of repeats must be a non-zero positive integer.")
+
+	if any(z < 1 for z in args.zones):
+		parser.error("The number of zones must be a non-zero positive integer.")
+
+	"""Input checks"""
+	for gff1, gff2 in args.inputs:
+		for gff in (gff1, gff2):
+			if not os.path.exists(gff):
+				sys.exit(f"Error: Input {gff} does not exist.")
+
+	os.makedirs(args.workdir, exist_ok=True)
+
+	"""Build cases"""
+	cases = []
+	for profile in args.profiles:
+		gff1, gff2 = generate_case(profile, args.numl, args.workdir)
+		cases.append((f"{profile}.{args.numl}", gff1, gff2))
+	for gff1, gff2 in args.inputs:
+		base1 = os.path.splitext(os.path.basename(gff1))[0]
+		base2 = os.path.splitext(os.path.basename(gff2))[0]
+		cases.append((f"{base1}.{base2}", gff1, gff2))
+
+	"""Code body"""
+	results = []
+	for case, gff1, gff2 in cases:
+		for engine in args.engines:
+			if ENGINES[engine]['zoned']:
+				zone_counts = args.zones
+			else:
+				zone_counts = [0]
+			for zones in zone_counts:
+				result = benchmark(case, gff1, gff2, engine, zones,
+								   args.warmup, args.repeats, args.workdir)
+				results.append(result)
+				print(f"{case}\t{engine}\tzones={zones}\t"
+					  f"median={result['median']:.4f}s\tiqr={result['iqr']:.4f}s\t"
+					  f"rss={result['peak_rss_kb']}KB\trows={result['rows']}")
+
+	check_rows(results)
+	if args.json:
+		write_json(results, args.json)
+	if args.tsv:
+		write_tsv(results, args.tsv)
+	if args.baseline and check_regressions(results, args.baseline, args.tolerance):
+		sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
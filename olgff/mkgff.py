@@ -4,77 +4,349 @@
 
 import argparse
 import random
-import gzip
-
-"""argparse statements"""
-parser = argparse.ArgumentParser(
-	description='Generate sample GFF files.',
-	formatter_class=argparse.RawTextHelpFormatter)
-parser.add_argument('--seqname', type=str, default='X',
-					help='Name of the chromosome or scaffold')
-parser.add_argument('--source', type=str, default='MKGFF',
-					help='Source of the feature')
-parser.add_argument('--feature', type=str, default='gene',
-					choices=['CDS', 'exon', 'gene', 'ncRNA',
-							 'pseudogene', 'rRNA', 'sequence_feature', 'tRNA'],
-					help='Select feature type')
-parser.add_argument('-n', '--numl', type=int, default=100,
-					help=('Set number of lines\n'
-						  'Default = 100'))
-parser.add_argument('-s', '--seed', type=int, default=1,
-					help=('Seed for random number generator\n'
-						  'Default = 1'))
-parser.add_argument('--maxfl', type=int, default=1000,
-					help=('Maximum feature length\n'
-						  'Default = 1000'))
-parser.add_argument('--length', type=int, default=10000,
-					help=('Max value for the last feature start location\n'
-						  'Default = 10000'))
-parser.add_argument('-o', '--output', type=str,
-					help=('Output file name\n'
-						  'Default = "mygff.gff"'))
-parser.add_argument('-c', '--compress', action='store_true',
-					help='Compress the output file to .gz')
-
-args = parser.parse_args()
-
-"""set seed for random"""
-random.seed(args.seed)
-
-"""generate GFF entries"""
-entries = []
-start_positions = sorted(random.sample(range(1, args.length), args.numl))
-previous_end = 0
-for start in start_positions:
-	min_end = max(start + 1, previous_end + 1)
-	max_end = min(start + args.maxfl, args.length)
-
-	if min_end > max_end:
-		continue
-
-	end = random.randint(min_end, max_end)
-	entry = [args.seqname, args.source, args.feature, start, end, '.', '.', '.', '.']
-	entries.append(entry)
-	previous_end = end
-
-"""write the GFF output"""
-gff_content = f"##gff-version 3\n##generated by mkgff\n##seed used {args.seed}\n##number of lines {args.numl}\n"
-for entry in entries:
-	gff_content += "\t".join(map(str, entry)) + "\n"
-
-if args.output:
-	output_file = args.output
-else:
-	output_file = "mygff.gff"
-
-if args.compress and not output_file.endswith('.gz'):
-	output_file += ".gz"
-
-if args.compress:
-	with gzip.open(output_file, 'wt') as f:
-		f.write(gff_content)
-elif args.output:
-	with open(output_file, 'w') as f:
-		f.write(gff_content)
-else:
-	print(gff_content)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gzio import open_output
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+
+"""Features generated and formatted at a time, bounds memory whatever -n is"""
+BATCH_SIZE = 100000
+
+
+def batch_counts(numl, nbatch):
+	"""Split numl features as evenly as possible over nbatch batches"""
+	base, extra = divmod(numl, nbatch)
+	return [base + 1 if i < extra else base for i in range(nbatch)]
+
+
+def sample_starts(rng, lo, hi, count):
+	"""Sorted unique starts in [lo, hi), memory grows with count, not hi - lo"""
+	span = hi - lo
+	if count * 2 > span:
+		"""Dense, pick the positions to leave out instead"""
+		keep = np.ones(span, dtype=bool)
+		keep[sample_starts(rng, 0, span, span - count)] = False
+		return np.flatnonzero(keep) + lo
+	starts = np.empty(0, dtype=np.int64)
+	while len(starts) < count:
+		extra = rng.integers(lo, hi, (count - len(starts)) * 11 // 10 + 16)
+		starts = np.unique(np.concatenate([starts, extra]))
+	"""Drop a random surplus so the kept starts stay uniform"""
+	if len(starts) > count:
+		starts = np.delete(starts, rng.choice(len(starts), len(starts) - count, replace=False))
+	return starts
+
+
+def uniform_features(rng, lo, hi, count, length, maxfl, params):
+	"""Non-overlapping features with uniformly spaced starts"""
+	count = min(count, hi - lo)
+	starts = sample_starts(rng, lo, hi, count)
+	ends = starts + rng.integers(1, maxfl, count, endpoint=True)
+	"""Clip ends so features never run into the next start, 1 bp features are kept"""
+	next_starts = np.empty_like(starts)
+	next_starts[:-1] = starts[1:]
+	next_starts[-1:] = hi
+	np.minimum(ends, next_starts - 1, out=ends)
+	return starts, ends
+
+
+def random_features(rng, lo, hi, count, length, maxfl, params):
+	"""Overlapping features with uniform starts and lengths"""
+	starts = rng.integers(lo, hi, count)
+	ends = starts + rng.integers(1, maxfl, count, endpoint=True)
+	return starts, ends
+
+
+def hotspot_features(rng, lo, hi, count, length, maxfl, params):
+	"""Features clustered around a few hotspots"""
+	"""Hotspots come from layout_seed so files made with other seeds share them"""
+	"""Starts falling outside the batch are redrawn around the same hotspot"""
+	spread = params['spread']
+	nhot = max(1, round(params['hotspots'] * (hi - lo) / (length - 1)))
+	margin = min(3 * int(spread), (hi - lo - 1) // 2)
+	centers = np.random.default_rng([params['layout_seed'], lo]).integers(lo + margin, hi - margin, nhot)
+	picks = rng.integers(0, nhot, count)
+	starts = centers[picks] + rng.normal(0, spread, count).astype(np.int64)
+	out = (starts < lo) | (starts >= hi)
+	while out.any():
+		starts[out] = centers[picks[out]] + rng.normal(0, spread, int(out.sum())).astype(np.int64)
+		out = (starts < lo) | (starts >= hi)
+	ends = starts + rng.integers(1, maxfl, count, endpoint=True)
+	return starts, ends
+
+
+def nested_features(rng, lo, hi, count, length, maxfl, params):
+	"""Stacks of depth features sharing a center, each inside the last"""
+	"""Centers are drawn far enough from the batch edges to hold the whole stack"""
+	depth = params['depth']
+	nnest = -(-count // depth)
+	outer = rng.integers(depth, max(depth, min(maxfl // 2, (hi - lo - 1) // 2)), nnest, endpoint=True)
+	centers = rng.integers(lo + outer, np.maximum(lo + outer + 1, hi - outer))
+	levels = np.arange(depth, 0, -1)
+	widths = (outer[:, None] * levels[None, :]) // depth
+	starts = (centers[:, None] - widths).ravel()[:count]
+	ends = (centers[:, None] + widths).ravel()[:count]
+	return starts, ends
+
+
+def spanning_features(rng, lo, hi, count, length, maxfl, params):
+	"""Short features with a fraction of very long spanning ones"""
+	starts, ends = random_features(rng, lo, hi, count, length, maxfl, params)
+	long_len = params['long_len']
+	is_long = rng.random(count) < params['long_frac']
+	nlong = int(is_long.sum())
+	ends[is_long] = starts[is_long] + rng.integers(long_len // 2, long_len, nlong, endpoint=True)
+	return starts, ends
+
+
+def heavytail_features(rng, lo, hi, count, length, maxfl, params):
+	"""Uniform starts with Pareto distributed lengths"""
+	starts = rng.integers(lo, hi, count)
+	lengths = 1 + (rng.pareto(params['alpha'], count) * params['scale']).astype(np.int64)
+	ends = starts + np.minimum(lengths, maxfl)
+	return starts, ends
+
+
+"""Named workloads, every value can be overridden from the command line"""
+PROFILES = {
+	'uniform': {
+		'features': uniform_features,
+		'numl': 100, 'seed': 1, 'nchrom': 1, 'length': 10000, 'maxfl': 1000,
+		'params': {}},
+	'hotspot': {
+		'features': hotspot_features,
+		'numl': 200000, 'seed': 101, 'nchrom': 4, 'length': 10000000, 'maxfl': 2000,
+		'params': {'hotspots': 20, 'spread': 5000, 'layout_seed': 201}},
+	'nested': {
+		'features': nested_features,
+		'numl': 200000, 'seed': 102, 'nchrom': 4, 'length': 10000000, 'maxfl': 200000,
+		'params': {'depth': 50}},
+	'spanning': {
+		'features': spanning_features,
+		'numl': 200000, 'seed': 103, 'nchrom': 4, 'length': 10000000, 'maxfl': 1000,
+		'params': {'long_frac': 0.001, 'long_len': 2000000}},
+	'heavytail': {
+		'features': heavytail_features,
+		'numl': 200000, 'seed': 104, 'nchrom': 4, 'length': 10000000, 'maxfl': 5000000,
+		'params': {'alpha': 1.1, 'scale': 200}},
+	'contigs': {
+		'features': random_features,
+		'numl': 200000, 'seed': 105, 'nchrom': 20000, 'length': 20000, 'maxfl': 1000,
+		'params': {}},
+}
+
+
+"""Valid ranges of the profile parameters"""
+PARAM_LIMITS = {
+	'hotspots': (lambda v: v >= 1, '>= 1'),
+	'spread': (lambda v: v >= 0, '>= 0'),
+	'layout_seed': (lambda v: v >= 0, '>= 0'),
+	'depth': (lambda v: v >= 1, '>= 1'),
+	'long_frac': (lambda v: 0 <= v <= 1, 'between 0 and 1'),
+	'long_len': (lambda v: v >= 2, '>= 2'),
+	'alpha': (lambda v: v > 0, '> 0'),
+	'scale': (lambda v: v > 0, '> 0'),
+}
+
+
+def numpy_batches(profile, seed, chrom_index, numl, length, maxfl, params):
+	"""Yield start-sorted (starts, ends) lists for one chromosome using NumPy"""
+	rng = np.random.default_rng([seed, chrom_index])
+	make_features = PROFILES[profile]['features']
+	nbatch = max(1, -(-numl // BATCH_SIZE))
+	span = (length - 1) / nbatch
+	carry = 0
+	for i, count in enumerate(batch_counts(numl, nbatch)):
+		lo = 1 + int(i * span)
+		hi = 1 + int((i + 1) * span)
+		"""Features a full batch could not place move on to the next one"""
+		count += carry
+		starts, ends = make_features(rng, lo, hi, count, length, maxfl, params)
+		carry = count - len(starts)
+		"""Profiles place starts inside the batch, this only guards batches"""
+		"""too small for a profile's shape so chromosomes stay sorted"""
+		np.clip(starts, lo, hi - 1, out=starts)
+		np.minimum(ends, length, out=ends)
+		order = np.argsort(starts, kind='stable')
+		starts = starts[order]
+		ends = ends[order]
+		keep = ends >= starts
+		yield starts[keep].tolist(), ends[keep].tolist()
+
+
+def python_batches(profile, seed, chrom_index, numl, length, maxfl, params):
+	"""Yield sorted (starts, ends) lists for one chromosome without NumPy"""
+	"""Only the uniform profile is available here"""
+	rng = random.Random(f"{seed}:{chrom_index}")
+	nbatch = max(1, -(-numl // BATCH_SIZE))
+	span = (length - 1) / nbatch
+	carry = 0
+	for i, count in enumerate(batch_counts(numl, nbatch)):
+		lo = 1 + int(i * span)
+		hi = 1 + int((i + 1) * span)
+		count += carry
+		carry = max(0, count - (hi - lo))
+		count -= carry
+		starts = sorted(rng.sample(range(lo, hi), count))
+		next_starts = starts[1:] + [hi]
+		ends = [min(start + rng.randint(1, maxfl), next_start - 1, length)
+				for start, next_start in zip(starts, next_starts)]
+		yield starts, ends
+
+
+def format_batch(seqname, source, feature, starts, ends):
+	"""Format one batch of features as GFF text"""
+	if not starts:
+		return ''
+	prefix = f"{seqname}\t{source}\t{feature}\t"
+	suffix = "\t.\t.\t.\t.\n"
+	coords = [f"{s}\t{e}" for s, e in zip(starts, ends)]
+	return prefix + (suffix + prefix).join(coords) + suffix
+
+
+def generate_gff(fp, profile, seqnames, source, feature, numl, seed, length, maxfl, params):
+	"""Stream features for every chromosome to an open text file"""
+	if np is not None:
+		make_batches = numpy_batches
+	else:
+		make_batches = python_batches
+	counts = batch_counts(numl, len(seqnames))
+	fp.write(f"##gff-version 3\n##generated by mkgff\n##seed used {seed}\n##number of lines {numl}\n")
+	if profile != 'uniform':
+		fp.write(f"##profile {profile} {params}\n")
+	for chrom_index, (seqname, count) in enumerate(zip(seqnames, counts)):
+		for starts, ends in make_batches(profile, seed, chrom_index, count, length, maxfl, params):
+			fp.write(format_batch(seqname, source, feature, starts, ends))
+
+
+def parse_params(profile, pairs):
+	"""Override profile parameters from key=value strings"""
+	params = dict(PROFILES[profile]['params'])
+	for pair in pairs:
+		key, sep, value = pair.partition('=')
+		if not sep or key not in params:
+			raise ValueError(f"Error: Parameter {pair} not recognised.\n"
+					 f"Profile {profile} accepts: {', '.join(params) or 'none'}")
+		try:
+			params[key] = type(params[key])(value)
+		except ValueError:
+			raise ValueError(f"Error: Parameter {key} expects {type(params[key]).__name__}, got {value}.")
+		check, expected = PARAM_LIMITS[key]
+		if not check(params[key]):
+			raise ValueError(f"Error: Parameter {key} must be {expected}, got {value}.")
+	return params
+
+
+def main():
+	"""argparse statements"""
+	parser = argparse.ArgumentParser(
+		description='Generate sample GFF files.',
+		formatter_class=argparse.RawTextHelpFormatter)
+	parser.add_argument('--profile', type=str, default='uniform',
+						choices=list(PROFILES),
+						help=('Workload profile\n'
+							  'uniform: non-overlapping, evenly spread features\n'
+							  'hotspot: features clustered around a few hotspots\n'
+							  'nested: deep stacks of intervals inside one another\n'
+							  'spanning: short features plus rare very long ones\n'
+							  'heavytail: Pareto distributed feature lengths\n'
+							  'contigs: many small contigs\n'
+							  'Profiles other than uniform need NumPy\n'
+							  'Default = uniform'))
+	parser.add_argument('-P', '--param', action='append', default=[],
+						metavar='KEY=VALUE',
+						help='Override a profile parameter, may be repeated')
+	parser.add_argument('--seqname', type=str, default='X',
+						help=('Name of the chromosome or scaffold\n'
+							  'Numbered [seqname]1..[seqname]N with --nchrom > 1'))
+	parser.add_argument('--nchrom', type=int,
+						help=('Number of chromosomes, lines are split evenly\n'
+							  'Default = profile value (uniform: 1)'))
+	parser.add_argument('--source', type=str, default='MKGFF',
+						help='Source of the feature')
+	parser.add_argument('--feature', type=str, default='gene',
+						choices=['CDS', 'exon', 'gene', 'ncRNA',
+								 'pseudogene', 'rRNA', 'sequence_feature', 'tRNA'],
+						help='Select feature type')
+	parser.add_argument('-n', '--numl', type=int,
+						help=('Set number of lines\n'
+							  'Default = profile value (uniform: 100)'))
+	parser.add_argument('-s', '--seed', type=int,
+						help=('Seed for random number generator\n'
+							  'Default = profile value (uniform: 1)'))
+	parser.add_argument('--maxfl', type=int,
+						help=('Maximum feature length\n'
+							  'Default = profile value (uniform: 1000)'))
+	parser.add_argument('--length', type=int,
+						help=('Max value for the last feature start location\n'
+							  'Per chromosome\n'
+							  'Default = profile value (uniform: 10000)'))
+	parser.add_argument('-o', '--output', type=str,
+						help=('Output file name\n'
+							  'Default = "mygff.gff"'))
+	parser.add_argument('-c', '--compress', action='store_true',
+						help='Compress the output file to .gz')
+	parser.add_argument('--level', type=int, default=6, choices=range(1, 10),
+						metavar='{1..9}',
+						help=('gzip compression level\n'
+							  'Default = 6'))
+
+	args = parser.parse_args()
+
+	"""fill unset values from the profile"""
+	profile = PROFILES[args.profile]
+	for key in ('numl', 'seed', 'nchrom', 'length', 'maxfl'):
+		if getattr(args, key) is None:
+			setattr(args, key, profile[key])
+	try:
+		params = parse_params(args.profile, args.param)
+	except ValueError as e:
+		sys.exit(str(e))
+
+	if args.profile != 'uniform' and np is None:
+		parser.error(f"The {args.profile} profile requires NumPy.")
+
+	if args.nchrom < 1:
+		parser.error("The number of chromosomes must be a non-zero positive integer.")
+
+	if args.numl > (args.length - 1) * args.nchrom:
+		parser.error("The number of lines cannot exceed the available start locations.")
+
+	if args.nchrom == 1:
+		seqnames = [args.seqname]
+	else:
+		seqnames = [f"{args.seqname}{i}" for i in range(1, args.nchrom + 1)]
+
+	"""write the GFF output"""
+	if args.output:
+		output_file = args.output
+	else:
+		output_file = "mygff.gff"
+
+	if args.compress and not output_file.endswith('.gz'):
+		output_file += ".gz"
+
+	gff_args = (args.profile, seqnames, args.source, args.feature, args.numl,
+				args.seed, args.length, args.maxfl, params)
+	try:
+		if args.compress:
+			with open_output(output_file, 'wt', args.level) as f:
+				generate_gff(f, *gff_args)
+		elif args.output:
+			with open(output_file, 'w') as f:
+				generate_gff(f, *gff_args)
+		else:
+			generate_gff(sys.stdout, *gff_args)
+	except IOError as e:
+		sys.exit(str(e))
+
+
+if __name__ == '__main__':
+	main()
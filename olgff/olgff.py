@@ -3,53 +3,14 @@
 # Henry Li
 
 import argparse
-import gzip
 import time
 import os
 import sys
 
-
-def read_gff(filename):
-	"""Store features to dictionary by chromosome from a GFF file"""
-	features = {}
-	try:
-		if filename.endswith('.gz'):
-			fp = gzip.open(filename, 'rt')
-		else:
-			fp = open(filename)
-	except Exception as e:
-		sys.exit(f"Error opening file {filename}: {e}")
-
-	while True:
-		line = fp.readline()
-		if line == '':
-			break
-		line = line.strip()
-		if line.startswith('#'):
-			continue
-		cols = line.split()
-		if len(cols) < 9:
-			continue
-		chrom = cols[0]
-		start = int(cols[3])
-		end = int(cols[4])
-		feature_info = {
-			"chrom": chrom,
-			"source": cols[1],
-			"feature_type": cols[2],
-			"start": start,
-			"end": end,
-			"score": cols[5],
-			"strand": cols[6],
-			"frame": cols[7],
-			"attribute": cols[8]
-		}
-		if chrom not in features:
-			features[chrom] = []
-		features[chrom].append(feature_info)
-
-	fp.close()
-	return features
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrument import Profiler
+from gzio import open_output
+from gffio import parse_region, read_gff
 
 
 def chr_filter(features1, features2):
@@ -97,15 +58,24 @@ def zoning(features, zone_len_marks, num_zones):
 	return zoned_features_by_chr
 
 
-def find_overlap(zoned_features1, zoned_features2):
+def find_overlap(zoned_features1, zoned_features2, same_strand=False, profiler=None, verbose=False):
 	"""Find overlapping features between two sets of zoned features"""
-	overlaps = set()
+	"""Pairs spanning several zones are only reported once"""
+	overlaps = []
+	seen = set()
 	for chr in zoned_features1:
 		for zone in zoned_features1[chr]:
 			if zone in zoned_features2[chr]:
+				zone_start_count = len(overlaps)
 				for feature1 in zoned_features1[chr][zone]:
 					for feature2 in zoned_features2[chr][zone]:
+						if same_strand and feature1['strand'] != feature2['strand']:
+							continue
 						if feature1['start'] <= feature2['end'] and feature2['start'] <= feature1['end']:
+							pair = (id(feature1), id(feature2))
+							if pair in seen:
+								continue
+							seen.add(pair)
 							overlap_start = max(
 								feature1['start'], feature2['start'])
 							overlap_end = min(feature1['end'], feature2['end'])
@@ -116,10 +86,17 @@ def find_overlap(zoned_features1, zoned_features2):
 								"feature1": feature1,
 								"feature2": feature2
 								}
-							overlaps.add(overlap)
-			print(zone, "Overlapped")
-		print("Chromosome:", chr, "Overlapped")
-	overlaps = list(overlaps)
+							overlaps.append(overlap)
+				if profiler is not None:
+					n1 = len(zoned_features1[chr][zone])
+					n2 = len(zoned_features2[chr][zone])
+					profiler.event("zone_pairs", chrom=chr, zone=zone,
+								   features1=n1, features2=n2, comparisons=n1 * n2,
+								   overlaps=len(overlaps) - zone_start_count)
+			if verbose:
+				print(zone, "Overlapped")
+		if verbose:
+			print("Chromosome:", chr, "Overlapped")
 	return overlaps
 
 
@@ -140,73 +117,148 @@ def write_output(overlaps, output_file):
 
 	output_content = '\n'.join(lines)
 
-	with open(output_file, 'w') as fp:
+	with open_output(output_file) as fp:
 		fp.write(output_content)
 
 
-"""argparse statements"""
-parser = argparse.ArgumentParser(
-	description='Find overlapped features between two GFF files using zone-based approach.',
-	formatter_class=argparse.RawTextHelpFormatter)
-parser.add_argument('gff1',
-					help='First input GFF file')
-parser.add_argument('gff2',
-					help='Second input GFF file')
-parser.add_argument('-z', '--zones', type=int, default=10,
-					help=('Number of zones to divide each chromosome into\n'
-						  'Default = 10'))
-parser.add_argument('-o', '--output', type=str,
-					help=('Output TSV file\n'
-						  'Default = [gff1_basename].[gff2_basename].overlap.tsv'))
-
-args = parser.parse_args()
-
-if args.zones == 0:
-	parser.error("The number of zones must be a non-zero positive integer.")
-
-"""Input checks"""
-if not os.path.exists(args.gff1):
-	sys.exit(f"Error: Input gff1 {args.gff1} does not exist.")
-
-if not args.gff1.endswith('.gff') and not args.gff1.endswith('.gff.gz'):
-	sys.exit(f"Error: Input gff1 type error.\nFile type gff/gff.gz expected.")
-
-if not os.path.exists(args.gff2):
-	sys.exit(f"Error: Input gff2 {args.gff2} does not exist.")
-
-if not args.gff2.endswith('.gff') and not args.gff2.endswith('.gff.gz'):
-	sys.exit(f"Error: Input gff2 type error.\nFile type gff/gff.gz expected.")
-
-"""Format outfile name"""
-if args.output:
-	output_file = args.output
-else:
-	base1 = os.path.splitext(os.path.basename(args.gff1))[0]
-	base2 = os.path.splitext(os.path.basename(args.gff2))[0]
-	output_file = f"{base1}.{base2}.overlap.tsv"
-
-"""Code body"""
-start_time = time.time()
-features1 = read_gff(args.gff1)
-print("Read GFF File 1")
-features2 = read_gff(args.gff2)
-print("Read GFF File 2")
-
-features1, features2 = chr_filter(features1, features2)
-print("None Overlapping Chromosomes Filtered")
-
-zone_len_marks = find_zone_len_marks(features1, features2, args.zones)
-print("Zone Marks Established")
-
-zoned_features1 = zoning(features1, zone_len_marks, args.zones)
-print("Zoned GFF File 1 Features")
-zoned_features2 = zoning(features2, zone_len_marks, args.zones)
-print("Zoned GFF File 2 Features")
-
-overlaps = find_overlap(zoned_features1, zoned_features2)
-print("------ALL OVERLAPS FOUND------")
-write_output(overlaps, output_file)
-print("Outfile Written")
-end_time = time.time()
-
-print(f"###Overlap gff features with {args.zones} zones completed in {end_time - start_time} seconds")
+def overlap_gff(gff1, gff2, num_zones=10, filters1=None, filters2=None,
+				same_strand=False, profiler=None, verbose=False):
+	"""Read, zone and overlap two GFF files, returns a list of dictionaries"""
+	"""filters1/filters2 are read_gff keyword arguments"""
+	if num_zones < 1:
+		raise ValueError("The number of zones must be a non-zero positive integer.")
+	if filters1 is None:
+		filters1 = {}
+	if filters2 is None:
+		filters2 = {}
+	if profiler is None:
+		profiler = Profiler()
+
+	with profiler.stage("read", file=gff1) as record:
+		features1 = read_gff(gff1, **filters1)
+		record["items"] = sum(len(f) for f in features1.values())
+	if verbose:
+		print("Read GFF File 1")
+	with profiler.stage("read", file=gff2) as record:
+		features2 = read_gff(gff2, **filters2)
+		record["items"] = sum(len(f) for f in features2.values())
+	if verbose:
+		print("Read GFF File 2")
+
+	with profiler.stage("filter") as record:
+		features1, features2 = chr_filter(features1, features2)
+		record["items"] = len(features1)
+	if verbose:
+		print("None Overlapping Chromosomes Filtered")
+
+	with profiler.stage("zone_marks") as record:
+		zone_len_marks = find_zone_len_marks(features1, features2, num_zones)
+		record["items"] = len(zone_len_marks) * num_zones
+	if verbose:
+		print("Zone Marks Established")
+
+	with profiler.stage("zoning", file=gff1) as record:
+		zoned_features1 = zoning(features1, zone_len_marks, num_zones)
+		record["items"] = sum(len(z) for zones in zoned_features1.values() for z in zones.values())
+	if verbose:
+		print("Zoned GFF File 1 Features")
+	with profiler.stage("zoning", file=gff2) as record:
+		zoned_features2 = zoning(features2, zone_len_marks, num_zones)
+		record["items"] = sum(len(z) for zones in zoned_features2.values() for z in zones.values())
+	if verbose:
+		print("Zoned GFF File 2 Features")
+
+	with profiler.stage("overlap") as record:
+		overlaps = find_overlap(zoned_features1, zoned_features2, same_strand, profiler, verbose)
+		record["items"] = len(overlaps)
+	if verbose:
+		print("------ALL OVERLAPS FOUND------")
+	return overlaps
+
+
+def main():
+	"""argparse statements"""
+	parser = argparse.ArgumentParser(
+		description='Find overlapped features between two GFF files using zone-based approach.',
+		formatter_class=argparse.RawTextHelpFormatter)
+	parser.add_argument('gff1',
+						help='First input GFF file')
+	parser.add_argument('gff2',
+						help='Second input GFF file')
+	parser.add_argument('-z', '--zones', type=int, default=10,
+						help=('Number of zones to divide each chromosome into\n'
+							  'Default = 10'))
+	parser.add_argument('-o', '--output', type=str,
+						help=('Output TSV file\n'
+							  'Default = [gff1_basename].[gff2_basename].overlap.tsv'))
+	parser.add_argument('--type1',
+						help='Only keep gff1 features of this type, e.g. CDS')
+	parser.add_argument('--type2',
+						help='Only keep gff2 features of this type, e.g. exon')
+	parser.add_argument('--strand', choices=['+', '-', '.'],
+						help='Only keep features on this strand')
+	parser.add_argument('--source',
+						help='Only keep features from this source')
+	parser.add_argument('--region',
+						help=('Only keep features within chr or chr:beg-end\n'
+							  'e.g. NC_000913.3:1-100000'))
+	parser.add_argument('--same_strand', action='store_true',
+						help='Only report overlaps of features on the same strand')
+	parser.add_argument('--profile', nargs='?', const='-', metavar='FILE',
+						help=('Write per-stage timing and memory as JSON lines\n'
+							  'To FILE, or to stderr when no file is given'))
+	parser.add_argument('--cprofile', metavar='FILE',
+						help='Dump cProfile stats for the whole run to FILE')
+
+	args = parser.parse_args()
+
+	if args.zones < 1:
+		parser.error("The number of zones must be a non-zero positive integer.")
+
+	"""Input checks"""
+	if not os.path.exists(args.gff1):
+		sys.exit(f"Error: Input gff1 {args.gff1} does not exist.")
+
+	if not args.gff1.endswith('.gff') and not args.gff1.endswith('.gff.gz'):
+		sys.exit(f"Error: Input gff1 type error.\nFile type gff/gff.gz expected.")
+
+	if not os.path.exists(args.gff2):
+		sys.exit(f"Error: Input gff2 {args.gff2} does not exist.")
+
+	if not args.gff2.endswith('.gff') and not args.gff2.endswith('.gff.gz'):
+		sys.exit(f"Error: Input gff2 type error.\nFile type gff/gff.gz expected.")
+
+	"""Format outfile name"""
+	if args.output:
+		output_file = args.output
+	else:
+		base1 = os.path.splitext(os.path.basename(args.gff1))[0]
+		base2 = os.path.splitext(os.path.basename(args.gff2))[0]
+		output_file = f"{base1}.{base2}.overlap.tsv"
+
+	"""Code body"""
+	try:
+		region = parse_region(args.region)
+		filters1 = {"feature_type": args.type1, "strand": args.strand,
+					"source": args.source, "region": region}
+		filters2 = {"feature_type": args.type2, "strand": args.strand,
+					"source": args.source, "region": region}
+		profiler = Profiler(args.profile is not None, args.profile, args.cprofile)
+
+		start_time = time.time()
+		overlaps = overlap_gff(args.gff1, args.gff2, args.zones, filters1, filters2,
+							   args.same_strand, profiler, verbose=True)
+		with profiler.stage("write", file=output_file) as record:
+			write_output(overlaps, output_file)
+			record["items"] = len(overlaps)
+		print("Outfile Written")
+		end_time = time.time()
+		profiler.close()
+	except (IOError, ValueError) as e:
+		sys.exit(str(e))
+
+	print(f"###Overlap gff features with {args.zones} zones completed in {end_time - start_time} seconds")
+
+
+if __name__ == '__main__':
+	main()
@@ -4,106 +4,103 @@
 
 import sys
 import os
-import gzip
+import glob
+import pickle
+import bisect
 import argparse
 import time
+from concurrent.futures import ProcessPoolExecutor
+from instrument import Profiler
+from gzio import open_output
+from gffio import parse_region, iter_gff, read_gff
 
 
-def read_gff(filename):
-	"""Store features to dictionary by chromosome from a GFF file"""
-	features = {}
+def build_index(features):
+	"""Sort gff1 features by start for bisect lookups"""
+	"""Features are split into tiers of similar length, each keeping its"""
+	"""longest length, so one long feature does not widen every search window"""
+	index = {}
+	for chrom, feature_list in features.items():
+		feature_list = sorted(feature_list, key=lambda x: x["start"])
+		tiers = {}
+		for rank, f in enumerate(feature_list):
+			tier = (f["end"] - f["start"]).bit_length()
+			if tier not in tiers:
+				tiers[tier] = ([], [], [])
+			starts, ranks, tier_features = tiers[tier]
+			starts.append(f["start"])
+			ranks.append(rank)
+			tier_features.append(f)
+		index[chrom] = []
+		for tier in sorted(tiers):
+			starts, ranks, tier_features = tiers[tier]
+			max_len = max(f["end"] - f["start"] for f in tier_features)
+			index[chrom].append((starts, ranks, tier_features, max_len))
+	return index
+
+
+def save_index(index, filename):
+	"""Pickle a built index so later runs skip read_gff"""
 	try:
-		if filename.endswith('.gz'):
-			fp = gzip.open(filename, 'rt')
-		else:
-			fp = open(filename)
+		with open(filename, 'wb') as fp:
+			pickle.dump(index, fp, protocol=pickle.HIGHEST_PROTOCOL)
+	except IOError as e:
+		raise IOError(f"Error writing index file {filename}: {e}") from e
+
+
+def load_index(filename):
+	"""Load an index written by save_index"""
+	try:
+		with open(filename, 'rb') as fp:
+			index = pickle.load(fp)
 	except Exception as e:
-		sys.exit(f"Error opening file {filename}: {e}")
-
-	while True:
-		line = fp.readline()
-		if line == '':
-			break
-		line = line.strip()
-		if line.startswith('#'):
-			continue
-		cols = line.split()
-		if len(cols) < 9:
-			continue
-		chrom = cols[0]
-		start = int(cols[3])
-		end = int(cols[4])
-		feature_info = {
-			"chrom": chrom,
-			"source": cols[1],
-			"feature_type": cols[2],
-			"start": start,
-			"end": end,
-			"score": cols[5],
-			"strand": cols[6],
-			"frame": cols[7],
-			"attribute": cols[8]
-		}
-		if chrom not in features:
-			features[chrom] = []
-		features[chrom].append(feature_info)
-
-	fp.close()
-	return features
-
-
-def find_overlap(features, gff2_file):
-	"""Overlaps each feature from gff2 with gff1 features"""
+		raise IOError(f"Error loading index file {filename}: {e}") from e
+	if not isinstance(index, dict) or not all(isinstance(t, list) for t in index.values()):
+		raise IOError(f"Error: Index file {filename} is out of date, rebuild it with --save_index.")
+	return index
+
+
+def query_index(index, chrom, start, end, strand=None):
+	"""Returns the indexed features overlapping chrom:start-end, in start order"""
+	"""Only features on strand are kept when strand is given"""
+	if chrom not in index:
+		return []
+	hits = []
+	for starts, ranks, feature_list, max_len in index[chrom]:
+		lo = bisect.bisect_left(starts, start - max_len)
+		hi = bisect.bisect_right(starts, end)
+		for i in range(lo, hi):
+			feature_info = feature_list[i]
+			if strand is not None and feature_info["strand"] != strand:
+				continue
+			if start <= feature_info["end"]:
+				hits.append((ranks[i], feature_info))
+	if len(index[chrom]) > 1:
+		hits.sort(key=lambda x: x[0])
+	return [feature_info for _, feature_info in hits]
+
+
+def find_overlap(index, gff2_file, filters=None, same_strand=False):
+	"""Overlaps each feature from gff2 with indexed gff1 features"""
 	"""Returns a list of dictionaries"""
 	overlaps = []
-	try:
-		if gff2_file.endswith('.gz'):
-			fp = gzip.open(gff2_file, 'rt')
-		else:
-			fp = open(gff2_file)
-	except Exception as e:
-		sys.exit(f"Error opening file {gff2_file}: {e}")
-
-	while True:
-		line = fp.readline()
-		if line == '':
-			break
-		line = line.strip()
-		if line.startswith('#'):
-			continue
-		fields = line.split()
-		if len(fields) < 9:
-			continue
-		chrom = fields[0]
-		start2 = int(fields[3])
-		end2 = int(fields[4])
-		feature2_info = {
-			"chrom": chrom,
-			"source": fields[1],
-			"feature_type": fields[2],
-			"start": start2,
-			"end": end2,
-			"score": fields[5],
-			"strand": fields[6],
-			"frame": fields[7],
-			"attribute": fields[8]
-		}
-		if chrom in features:
-			for feature1_info in features[chrom]:
-				start1 = feature1_info["start"]
-				end1 = feature1_info["end"]
-				if start1 <= end2 and start2 <= end1:
-					overlap_start = max(start1, start2)
-					overlap_end = min(end1, end2)
-					overlaps.append({
-						"chrom": chrom,
-						"overlap_start": overlap_start,
-						"overlap_end": overlap_end,
-						"feature1": feature1_info,
-						"feature2": feature2_info
-					})
-
-	fp.close()
+	if filters is None:
+		filters = {}
+
+	for feature2_info in iter_gff(gff2_file, **filters):
+		chrom = feature2_info["chrom"]
+		start2 = feature2_info["start"]
+		end2 = feature2_info["end"]
+		strand = feature2_info["strand"] if same_strand else None
+		for feature1_info in query_index(index, chrom, start2, end2, strand):
+			overlaps.append({
+				"chrom": chrom,
+				"overlap_start": max(feature1_info["start"], start2),
+				"overlap_end": min(feature1_info["end"], end2),
+				"feature1": feature1_info,
+				"feature2": feature2_info
+			})
+
 	return overlaps
 
 
@@ -121,55 +118,192 @@ def write_output(overlaps, output_file):
 				f"{f1['frame']}\t{f2['frame']}\t{f1['attribute']}\t{f2['attribute']}")
 		lines.append(line)
 
-		output_content = '\n'.join(lines)
+	output_content = '\n'.join(lines)
+
+	with open_output(output_file) as f:
+		f.write(output_content)
+
+
+_worker = {}
+
 
-		with open(output_file, 'w') as f:
-			f.write(output_content)
+def _init_worker(index, filters, same_strand, profile=False):
+	"""Hand the shared index and query filters to each worker process once"""
+	_worker["index"] = index
+	_worker["filters"] = filters
+	_worker["same_strand"] = same_strand
+	_worker["profile"] = profile
+
+
+def run_query(gff2_file, output_file):
+	"""Overlap one query file against the worker index"""
+	"""Stage records are returned for the parent to write"""
+	profiler = Profiler(_worker["profile"], None)
+	with profiler.stage("overlap", file=gff2_file) as record:
+		overlaps = find_overlap(_worker["index"], gff2_file,
+								_worker["filters"], _worker["same_strand"])
+		record["items"] = len(overlaps)
+	with profiler.stage("write", file=output_file) as record:
+		write_output(overlaps, output_file)
+		record["items"] = len(overlaps)
+	return gff2_file, len(overlaps), profiler.records
+
+
+def expand_queries(patterns):
+	"""Expand glob patterns in query arguments, keeping order"""
+	queries = []
+	for pattern in patterns:
+		if glob.has_magic(pattern):
+			matches = sorted(glob.glob(pattern))
+			if not matches:
+				raise IOError(f"Error: No files match {pattern}.")
+			queries.extend(matches)
+		else:
+			queries.append(pattern)
+	return queries
 
 
 def main():
 	"""argparse statements"""
 	parser = argparse.ArgumentParser(
-		description='Find overlapped features between two GFF files.',
+		description='Find overlapped features between a reference GFF and one or more query GFF files.',
 		formatter_class=argparse.RawTextHelpFormatter)
 	parser.add_argument('gff1', 
-					 	help='First input GFF file')
-	parser.add_argument('gff2', 
-					 	help='Second input GFF file')
+					 	help=('First input GFF file\n'
+							  'Or an index file written by --save_index (.idx)'))
+	parser.add_argument('gff2', nargs='+',
+					 	help=('Query GFF files\n'
+							  'Quoted glob patterns are expanded'))
 	parser.add_argument('-o', '--output', 
 						help=('Output TSV file, file name length < 256\n'
+							  'Only valid with a single query file\n'
 							  'Default = [gff1_basename].[gff2_basename].overlap.tsv'))
+	parser.add_argument('-d', '--outdir',
+						help=('Directory for per-query output files\n'
+							  'Default = next to each query file'))
+	parser.add_argument('-p', '--processes', type=int, default=1,
+						help=('Number of query files processed concurrently\n'
+							  'Default = 1'))
+	parser.add_argument('--save_index',
+						help='Write the gff1 index to this file for later runs')
+	parser.add_argument('--type1',
+						help='Only keep gff1 features of this type, e.g. CDS')
+	parser.add_argument('--type2',
+						help='Only keep gff2 features of this type, e.g. exon')
+	parser.add_argument('--strand', choices=['+', '-', '.'],
+						help='Only keep features on this strand')
+	parser.add_argument('--source',
+						help='Only keep features from this source')
+	parser.add_argument('--region',
+						help=('Only keep features within chr or chr:beg-end\n'
+							  'e.g. NC_000913.3:1-100000'))
+	parser.add_argument('--same_strand', action='store_true',
+						help='Only report overlaps of features on the same strand')
+	parser.add_argument('--profile', nargs='?', const='-', metavar='FILE',
+						help=('Write per-stage timing and memory as JSON lines\n'
+							  'To FILE, or to stderr when no file is given'))
+	parser.add_argument('--cprofile', metavar='FILE',
+						help=('Dump cProfile stats to FILE\n'
+							  'Only covers the main process with --processes > 1'))
 
 	args = parser.parse_args()
+	try:
+		queries = expand_queries(args.gff2)
+	except IOError as e:
+		sys.exit(str(e))
+
+	if args.processes < 1:
+		parser.error("The number of processes must be a non-zero positive integer.")
 
 	"""Input checks"""
 	if not os.path.exists(args.gff1):
 		sys.exit(f"Error: Input gff1 {args.gff1} does not exist.")
 
-	if not args.gff1.endswith('.gff') and not args.gff1.endswith('.gff.gz'):
-		sys.exit("Error: Input gff1 type error.\nFile type gff/gff.gz expected.")
+	if not args.gff1.endswith('.gff') and not args.gff1.endswith('.gff.gz') and not args.gff1.endswith('.idx'):
+		sys.exit("Error: Input gff1 type error.\nFile type gff/gff.gz/idx expected.")
+
+	for gff2 in queries:
+		if not os.path.exists(gff2):
+			sys.exit(f"Error: Input gff2 {gff2} does not exist.")
 
-	if not os.path.exists(args.gff2):
-		sys.exit(f"Error: Input gff2 {args.gff2} does not exist.")
+		if not gff2.endswith('.gff') and not gff2.endswith('.gff.gz'):
+			sys.exit(f"Error: Input gff2 {gff2} type error.\nFile type gff/gff.gz expected.")
 
-	if not args.gff2.endswith('.gff') and not args.gff2.endswith('.gff.gz'):
-		sys.exit("Error: Input gff2 type error.\nFile type gff/gff.gz expected.")
+	if args.gff1.endswith('.idx') and (args.type1 or args.strand or args.source or args.region):
+		sys.exit("Error: gff1 filters cannot be applied to a saved index.")
 
-	"""Format outfile name"""
-	if args.output:
-		output_file = args.output
-	else:
-		base1 = os.path.splitext(args.gff1)[0]
-		base2 = os.path.splitext(args.gff2)[0]
-		output_file = f"{base1}.{base2}.overlap.tsv"
+	if args.output and len(queries) > 1:
+		sys.exit("Error: --output only accepts a single query file, use --outdir instead.")
+
+	"""Format outfile names"""
+	"""Without --outdir each output goes next to its query file"""
+	output_files = []
+	base1 = os.path.splitext(os.path.basename(args.gff1))[0]
+	for gff2 in queries:
+		if args.output:
+			output_files.append(args.output)
+		else:
+			base2 = os.path.splitext(os.path.basename(gff2))[0]
+			outdir = args.outdir if args.outdir else os.path.dirname(gff2)
+			output_files.append(os.path.join(outdir, f"{base1}.{base2}.overlap.tsv"))
+
+	seen = {}
+	for gff2, output_file in zip(queries, output_files):
+		key = os.path.realpath(output_file)
+		if key in seen:
+			sys.exit(f"Error: Queries {seen[key]} and {gff2} would both write {output_file}.")
+		seen[key] = gff2
+
+	if args.outdir:
+		os.makedirs(args.outdir, exist_ok=True)
 
 	"""Code body"""
-	start_time = time.time()
-	features = read_gff(args.gff1)
-	overlaps = find_overlap(features, args.gff2)
-	write_output(overlaps, output_file)
-	end_time = time.time()
-	
+	try:
+		region = parse_region(args.region)
+		filters1 = {"feature_type": args.type1, "strand": args.strand,
+					"source": args.source, "region": region}
+		filters2 = {"feature_type": args.type2, "strand": args.strand,
+					"source": args.source, "region": region}
+
+		profiler = Profiler(args.profile is not None, args.profile, args.cprofile)
+		profile = args.profile is not None
+
+		start_time = time.time()
+		if args.gff1.endswith('.idx'):
+			with profiler.stage("read", file=args.gff1) as record:
+				index = load_index(args.gff1)
+				record["items"] = sum(len(t[0]) for tiers in index.values() for t in tiers)
+		else:
+			with profiler.stage("read", file=args.gff1) as record:
+				features = read_gff(args.gff1, **filters1)
+				record["items"] = sum(len(f) for f in features.values())
+			with profiler.stage("index") as record:
+				index = build_index(features)
+				record["items"] = len(index)
+			del features
+		if args.save_index:
+			with profiler.stage("save_index", file=args.save_index):
+				save_index(index, args.save_index)
+
+		if args.processes == 1 or len(queries) == 1:
+			_init_worker(index, filters2, args.same_strand, profile)
+			for gff2, count, records in map(run_query, queries, output_files):
+				for record in records:
+					profiler.emit(record)
+				print(f"{gff2}: {count} overlaps")
+		else:
+			with ProcessPoolExecutor(max_workers=args.processes,
+									 initializer=_init_worker,
+									 initargs=(index, filters2, args.same_strand, profile)) as pool:
+				for gff2, count, records in pool.map(run_query, queries, output_files):
+					for record in records:
+						profiler.emit(record)
+					print(f"{gff2}: {count} overlaps")
+		end_time = time.time()
+		profiler.close()
+	except (IOError, ValueError) as e:
+		sys.exit(str(e))
+
 	print(f"Overlap completed in {end_time - start_time} seconds")
 
 
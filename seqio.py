@@ -0,0 +1,118 @@
+# Block based FASTA and GBFF readers shared by the sequence tools
+# Henry Li
+
+import sys
+import mmap
+from gzio import open_input
+
+BLOCK_SIZE = 1 << 24
+
+FASTA_SEP = b'\n>'
+GBFF_SEP = b'\n//'
+GBFF_SEQ_JUNK = b'0123456789 \t\r\n/'
+
+
+def open_binary(filename):
+	"""Open a plain, gzipped or stdin ('-') input for binary reading"""
+	try:
+		if filename == '-':
+			return sys.stdin.buffer
+		elif filename.endswith('.gz'):
+			return open_input(filename, 'rb')
+		else:
+			return open(filename, 'rb')
+	except Exception as e:
+		raise IOError(f"Error opening file {filename}: {e}") from e
+
+
+def read_blocks(filename):
+	"""Yield large binary blocks, or a single mmap for plain files"""
+	fp = open_binary(filename)
+	try:
+		if filename != '-' and not filename.endswith('.gz'):
+			try:
+				mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+			except (ValueError, OSError):
+				"""Empty or unmappable file, fall back to block reads"""
+				mm = None
+			if mm is not None:
+				try:
+					yield mm
+				finally:
+					mm.close()
+				return
+		while True:
+			block = fp.read(BLOCK_SIZE)
+			if not block:
+				break
+			yield block
+	finally:
+		if fp is not sys.stdin.buffer:
+			fp.close()
+
+
+def iter_records(filename, sep):
+	"""Yield raw records as bytes, splitting just after each newline of sep"""
+	buf = bytearray()
+	for block in read_blocks(filename):
+		if isinstance(block, mmap.mmap):
+			data = block
+		else:
+			buf += block
+			data = buf
+		pos = 0
+		scan = max(len(data) - len(block) - len(sep) + 1, 0)
+		while True:
+			nxt = data.find(sep, scan)
+			if nxt == -1:
+				break
+			yield bytes(data[pos:nxt + 1])
+			pos = nxt + 1
+			scan = pos
+		if data is buf:
+			del buf[:pos]
+		elif pos < len(data):
+			yield data[pos:]
+	if buf:
+		yield bytes(buf)
+
+
+def read_fasta(filename):
+	"""Iteratively read (name, seq) records from a FASTA file"""
+	"""Names are str, sequences are bytes with newlines removed"""
+	for record in iter_records(filename, FASTA_SEP):
+		if not record.startswith(b'>'):
+			continue
+		nl = record.find(b'\n')
+		if nl == -1:
+			yield (record[1:].decode().rstrip(), b'')
+			continue
+		name = record[1:nl].decode().rstrip()
+		seq = record[nl + 1:].translate(None, b'\r\n')
+		yield (name, seq)
+
+
+def read_gbff(filename):
+	"""Iteratively read (info, seq) records from a GBFF file"""
+	"""info is the list of lines before ORIGIN, seq is bytes"""
+	found = False
+	for record in iter_records(filename, GBFF_SEP):
+		if record.startswith(b'//'):
+			record = record[record.find(b'\n') + 1:]
+		if record.startswith(b'ORIGIN'):
+			origin = 0
+		else:
+			origin = record.find(b'\nORIGIN')
+			if origin == -1:
+				continue
+			origin += 1
+		info = [line.rstrip() for line in record[:origin].decode().splitlines()]
+		seq_start = record.find(b'\n', origin)
+		if seq_start == -1:
+			seq = b''
+		else:
+			seq = record[seq_start:].translate(None, GBFF_SEQ_JUNK)
+		found = True
+		yield (info, seq)
+	if not found:
+		raise ValueError("Error: Input file format error.")
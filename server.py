@@ -0,0 +1,302 @@
+#! /usr/bin/env python
+# Resident overlap and k-mer query server over a Unix socket or HTTP
+# Henry Li
+
+import argparse
+import json
+import os
+import socketserver
+import stat
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from gffio import read_gff
+from overlap import build_index, load_index, query_index
+from seqio import read_fasta
+from twobit import read_twobit, iter_chunks
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+
+"""2-bit codes of the bases an indexed k-mer may hold, other bytes map to 4"""
+BASE_CODES = bytes(('ACGT'.find(chr(b)) if chr(b) in 'ACGT' else 4) for b in range(256))
+
+
+def encode_kmers(chunk, kmer_size):
+	"""Codes of every k-mer in an upper case chunk, and a mask of the pure ACGT ones"""
+	nwin = len(chunk) - kmer_size + 1
+	if nwin <= 0:
+		return np.empty(0, dtype=np.uint64), np.empty(0, dtype=bool)
+	bases = np.frombuffer(chunk.translate(BASE_CODES), dtype=np.uint8)
+	codes = np.zeros(nwin, dtype=np.uint64)
+	for j in range(kmer_size):
+		codes <<= np.uint64(2)
+		codes |= (bases[j:j + nwin] & 3).astype(np.uint64)
+	bad = np.concatenate(([0], np.cumsum(bases == 4)))
+	valid = bad[kmer_size:] == bad[:nwin]
+	return codes, valid
+
+
+def build_kmer_index(input_file, kmer_size, both_strands=False):
+	"""Index k-mers over every record of a FASTA or .2bit file"""
+	"""K-mers are packed 2 bits per base into one sorted code array, with parallel"""
+	"""arrays of record number and signed position (negative on the reverse"""
+	"""strand), so a lookup is a binary search. Bases are upper-cased so"""
+	"""soft-masked k-mers match; k-mers holding N or other codes are skipped"""
+	if input_file.endswith('.2bit'):
+		records = read_twobit(input_file)
+	else:
+		records = read_fasta(input_file)
+	names = []
+	codes = []
+	record_ids = []
+	positions = []
+	strands = [(False, 1)]
+	if both_strands:
+		strands.append((True, -1))
+	for defline, seq in records:
+		names.append(defline.split()[0] if defline else defline)
+		for reverse, sign in strands:
+			for offset, chunk in iter_chunks(seq, kmer_size - 1, reverse=reverse):
+				chunk_codes, valid = encode_kmers(chunk.upper(), kmer_size)
+				where = np.flatnonzero(valid)
+				codes.append(chunk_codes[where])
+				positions.append(sign * (where + offset + 1))
+				record_ids.append(np.full(len(where), len(names) - 1, dtype=np.int32))
+	if not codes:
+		codes = [np.empty(0, dtype=np.uint64)]
+		record_ids = [np.empty(0, dtype=np.int32)]
+		positions = [np.empty(0, dtype=np.int64)]
+	codes = np.concatenate(codes)
+	"""Stable, so each k-mer keeps record order and forward before reverse"""
+	order = np.argsort(codes, kind='stable')
+	codes = codes[order]
+	record_ids = np.concatenate(record_ids)[order]
+	positions = np.concatenate(positions)[order]
+	del order
+	return {
+		"kmer_size": kmer_size,
+		"names": names,
+		"codes": codes,
+		"records": record_ids,
+		"positions": positions,
+		"distinct": int(np.count_nonzero(np.diff(codes))) + 1 if len(codes) else 0
+	}
+
+
+def overlap_queries(index, queries):
+	"""Answer a batch of [chrom, start, end] or [chrom, start, end, strand] queries"""
+	results = []
+	for query in queries:
+		if not isinstance(query, (list, tuple)) or not 3 <= len(query) <= 4:
+			raise ValueError(f"Error: Query {query} format error.\n[chrom, start, end(, strand)] expected.")
+		chrom, start, end = query[0], int(query[1]), int(query[2])
+		strand = query[3] if len(query) == 4 else None
+		results.append(query_index(index, chrom, start, end, strand))
+	return results
+
+
+def kmer_queries(index, kmers):
+	"""Answer a batch of k-mer lookups, each a list of [name, pos]"""
+	"""Lookups ignore case; unknown, wrong length or non-ACGT k-mers give []"""
+	results = []
+	kmer_size = index["kmer_size"]
+	names = index["names"]
+	for kmer in kmers:
+		kmer = str(kmer).upper().encode()
+		codes, valid = encode_kmers(kmer, kmer_size)
+		if len(kmer) != kmer_size or not valid[0]:
+			results.append([])
+			continue
+		lo = int(np.searchsorted(index["codes"], codes[0], side='left'))
+		hi = int(np.searchsorted(index["codes"], codes[0], side='right'))
+		results.append([[names[r], p] for r, p in zip(index["records"][lo:hi].tolist(),
+													   index["positions"][lo:hi].tolist())])
+	return results
+
+
+def handle_request(indexes, request):
+	"""Dispatch one decoded request, returns the response dictionary"""
+	"""Errors are reported in the response so the connection stays usable"""
+	try:
+		if not isinstance(request, dict):
+			raise ValueError("Error: Request must be a JSON object.")
+		op = request.get("op")
+		if op == "overlap":
+			if indexes.get("gff") is None:
+				raise ValueError("Error: No GFF index loaded.")
+			return {"results": overlap_queries(indexes["gff"], request.get("queries", []))}
+		elif op == "kmer":
+			if indexes.get("kmer") is None:
+				raise ValueError("Error: No k-mer index loaded.")
+			return {"results": kmer_queries(indexes["kmer"], request.get("kmers", []))}
+		elif op == "info":
+			kmer_index = indexes.get("kmer")
+			return {"gff_chroms": len(indexes.get("gff") or {}),
+					"kmers": kmer_index["distinct"] if kmer_index else 0,
+					"kmer_positions": len(kmer_index["codes"]) if kmer_index else 0,
+					"kmer_size": indexes.get("kmer_size")}
+		else:
+			raise ValueError(f"Error: Unknown op {op}.\nop overlap/kmer/info expected.")
+	except ValueError as e:
+		return {"error": str(e)}
+	except TypeError as e:
+		return {"error": f"Error: Request format error: {e}."}
+	except Exception as e:
+		"""Anything else is still answered, so the connection stays usable"""
+		return {"error": f"Error: Request failed: {e!r}"}
+
+
+class UnixHandler(socketserver.StreamRequestHandler):
+	"""One JSON request per line, one JSON response per line, until the client closes"""
+
+	def handle(self):
+		for line in self.rfile:
+			if not line.strip():
+				continue
+			try:
+				request = json.loads(line)
+			except ValueError as e:
+				response = {"error": f"Error: Request is not valid JSON: {e}"}
+			else:
+				response = handle_request(self.server.indexes, request)
+			self.wfile.write(json.dumps(response).encode() + b'\n')
+			self.wfile.flush()
+
+
+class HTTPHandler(BaseHTTPRequestHandler):
+	"""POST a JSON request to / or to /overlap and /kmer, which set op"""
+	protocol_version = 'HTTP/1.1'
+
+	def do_POST(self):
+		try:
+			length = int(self.headers.get('Content-Length', 0))
+		except ValueError:
+			length = -1
+		if length < 0:
+			request = None
+			response = {"error": "Error: Content-Length header is not a valid length."}
+			self.close_connection = True
+		else:
+			try:
+				request = json.loads(self.rfile.read(length) or b'{}')
+			except ValueError as e:
+				request = None
+				response = {"error": f"Error: Request is not valid JSON: {e}"}
+		if request is not None:
+			op = self.path.strip('/')
+			if op and isinstance(request, dict):
+				request.setdefault("op", op)
+			response = handle_request(self.server.indexes, request)
+		body = json.dumps(response).encode()
+		self.send_response(400 if "error" in response else 200)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		"""Per-request logging would dominate sub-millisecond queries"""
+		pass
+
+
+class UnixServer(socketserver.ThreadingUnixStreamServer):
+	daemon_threads = True
+
+
+def main():
+	"""argparse statements"""
+	parser = argparse.ArgumentParser(
+		description='Serve GFF overlap and k-mer lookups from indexes loaded once.',
+		formatter_class=argparse.RawTextHelpFormatter)
+	parser.add_argument('-g', '--gff',
+						help=('Reference GFF file, or an index saved by overlap.py --save_index\n'
+							  'Accept .gff/.gff.gz/.idx'))
+	parser.add_argument('-f', '--fasta',
+						help=('Sequence file for k-mer lookups\n'
+							  'Accept .fasta/.fa and their .gz, or .2bit\n'
+							  'Needs NumPy, k-mers holding N or other codes are not indexed'))
+	parser.add_argument('-k', '--kmer_size', type=int, default=3,
+						help=('Length of k-mers, at most 32\n'
+							  'Default = 3'))
+	parser.add_argument('-b', '--both_strands', action='store_true',
+						help='Index k-mers on both strands')
+	parser.add_argument('--type', help='Only load features of this type')
+	parser.add_argument('--strand', choices=['+', '-'],
+						help='Only load features on this strand')
+	parser.add_argument('--source', help='Only load features from this source')
+	parser.add_argument('-s', '--socket',
+						help='Listen on this Unix socket path')
+	parser.add_argument('-p', '--port', type=int,
+						help='Listen for HTTP on this port')
+	parser.add_argument('--host', default='127.0.0.1',
+						help=('HTTP address to bind\n'
+							  'Default = 127.0.0.1'))
+
+	args = parser.parse_args()
+
+	"""Input checks"""
+	if not args.gff and not args.fasta:
+		parser.error("At least one of --gff or --fasta is required.")
+
+	if (args.socket is None) == (args.port is None):
+		parser.error("Exactly one of --socket or --port is required.")
+
+	if not 1 <= args.kmer_size <= 32:
+		parser.error("The k-mer size must be between 1 and 32.")
+
+	if args.fasta and np is None:
+		parser.error("The k-mer index requires NumPy.")
+
+	for input_file in (args.gff, args.fasta):
+		if input_file and not os.path.exists(input_file):
+			sys.exit(f"Error: Input file {input_file} does not exist.")
+
+	if args.socket and os.path.lexists(args.socket) and not stat.S_ISSOCK(os.lstat(args.socket).st_mode):
+		sys.exit(f"Error: {args.socket} exists and is not a socket.")
+
+	"""Load indexes"""
+	indexes = {"gff": None, "kmer": None, "kmer_size": None}
+	try:
+		start_time = time.time()
+		if args.gff and args.gff.endswith('.idx'):
+			indexes["gff"] = load_index(args.gff)
+		elif args.gff:
+			indexes["gff"] = build_index(read_gff(args.gff, args.type, args.strand, args.source))
+		if args.fasta:
+			indexes["kmer"] = build_kmer_index(args.fasta, args.kmer_size, args.both_strands)
+			indexes["kmer_size"] = args.kmer_size
+	except (IOError, ValueError) as e:
+		sys.exit(str(e))
+	print(f"Indexes loaded in {time.time() - start_time} seconds", file=sys.stderr)
+
+	"""Code body"""
+	try:
+		if args.socket:
+			if os.path.lexists(args.socket):
+				"""Only a stale socket from an earlier run, checked above"""
+				os.unlink(args.socket)
+			server = UnixServer(args.socket, UnixHandler)
+			where = args.socket
+		else:
+			server = ThreadingHTTPServer((args.host, args.port), HTTPHandler)
+			where = f"http://{args.host}:{args.port}"
+	except OSError as e:
+		sys.exit(f"Error: Cannot listen on {args.socket or args.port}: {e}")
+	server.indexes = indexes
+	print(f"Serving on {where}", file=sys.stderr)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		if args.socket and os.path.exists(args.socket):
+			os.unlink(args.socket)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,346 @@
+#! /usr/bin/env python
+# Convert FASTA/GBFF to a 2-bit packed sequence store and read it back
+# Henry Li
+
+import argparse
+import bisect
+import mmap
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+from seqio import read_fasta, read_gbff
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+"""UCSC .2bit layout, bases packed T=0 C=1 A=2 G=3, four per byte"""
+SIGNATURE = 0x1A412743
+ENCODE = bytes('TCAG'.find(chr(b).upper()) if chr(b) in 'TCAGtcag' else 0 for b in range(256))
+DECODE = [''.join('TCAG'[(b >> s) & 3] for s in (6, 4, 2, 0)).encode() for b in range(256)]
+PACK = {bytes((a, b, c, d)): (a << 6) | (b << 4) | (c << 2) | d
+		for a in range(4) for b in range(4) for c in range(4) for d in range(4)}
+COMP = bytes.maketrans(b'ACGTRYMKWSBDHVNacgtrymkwsbdhvn',
+					  b'TGCAYRKMWSVHDBNtgcayrkmwsvhdbn')
+N_RUN = re.compile(rb'[^ACGTacgt]+')
+MASK_RUN = re.compile(rb'[a-z]+')
+
+"""Bases per chunk when sliding over a sequence, a multiple of the 60 base FASTA line"""
+CHUNK_SIZE = 60 << 14
+
+if np is not None:
+	DECODE_LUT = np.frombuffer(b''.join(DECODE), dtype=np.uint8).reshape(256, 4)
+
+
+def pack_seq(seq):
+	"""Pack a bytes sequence into 2-bit codes, non-ACGT bases become T"""
+	codes = seq.translate(ENCODE)
+	codes += b'\x00' * (-len(codes) % 4)
+	if np is not None:
+		a = np.frombuffer(codes, dtype=np.uint8).reshape(-1, 4)
+		return ((a[:, 0] << 6) | (a[:, 1] << 4) | (a[:, 2] << 2) | a[:, 3]).astype(np.uint8).tobytes()
+	return bytes(map(PACK.__getitem__, (codes[i:i + 4] for i in range(0, len(codes), 4))))
+
+
+def unpack_seq(packed):
+	"""Expand 2-bit packed bytes into upper case bases, four per byte"""
+	if np is not None:
+		return DECODE_LUT[np.frombuffer(packed, dtype=np.uint8)].tobytes()
+	return b''.join(map(DECODE.__getitem__, packed))
+
+
+def runs(pattern, seq):
+	"""Starts and sizes of the runs matched by pattern"""
+	starts = []
+	sizes = []
+	for m in pattern.finditer(seq):
+		starts.append(m.start())
+		sizes.append(m.end() - m.start())
+	return starts, sizes
+
+
+def encode_record(seq):
+	"""Serialise one sequence as a .2bit record"""
+	n_starts, n_sizes = runs(N_RUN, seq)
+	mask_starts, mask_sizes = runs(MASK_RUN, seq)
+	parts = [struct.pack('<II', len(seq), len(n_starts)),
+			 struct.pack(f'<{len(n_starts)}I', *n_starts),
+			 struct.pack(f'<{len(n_sizes)}I', *n_sizes),
+			 struct.pack('<I', len(mask_starts)),
+			 struct.pack(f'<{len(mask_starts)}I', *mask_starts),
+			 struct.pack(f'<{len(mask_sizes)}I', *mask_sizes),
+			 struct.pack('<I', 0),
+			 pack_seq(seq)]
+	return b''.join(parts)
+
+
+def write_twobit(records, output_file):
+	"""Write (name, seq) records to a .2bit file"""
+	"""Records are spooled to a temp file so only one is held in memory"""
+	names = []
+	seen = set()
+	offsets = []
+	with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(output_file))) as tmp:
+		for name, seq in records:
+			name = name.split()[0] if name else f"seq{len(names) + 1}"
+			if len(name.encode()) > 255:
+				raise ValueError(f"Error: Sequence name {name[:32]}... exceeds 255 bytes.")
+			if name in seen:
+				raise ValueError(f"Error: Duplicate sequence name {name}.\n.2bit names must be unique.")
+			seen.add(name)
+			names.append(name)
+			offsets.append(tmp.tell())
+			tmp.write(encode_record(seq))
+		data_size = tmp.tell()
+		index_size = sum(1 + len(n.encode()) + 4 for n in names)
+		version = 0
+		if 16 + index_size + data_size >= 1 << 32:
+			version = 1
+			index_size += 4 * len(names)
+		base = 16 + index_size
+		try:
+			with open(output_file, 'wb') as fp:
+				fp.write(struct.pack('<IIII', SIGNATURE, version, len(names), 0))
+				for name, offset in zip(names, offsets):
+					fp.write(struct.pack('<B', len(name.encode())) + name.encode())
+					if version == 0:
+						fp.write(struct.pack('<I', base + offset))
+					else:
+						fp.write(struct.pack('<Q', base + offset))
+				tmp.seek(0)
+				shutil.copyfileobj(tmp, fp, 1 << 24)
+		except IOError as e:
+			raise IOError(f"Error writing to output file {output_file}: {e}") from e
+	return names
+
+
+def iter_chunks(seq, overlap, reverse=False, chunk_size=CHUNK_SIZE):
+	"""Yield (offset, chunk) pieces of bytes or a TwoBitSeq"""
+	"""Each chunk runs overlap bases into the next, so windows of overlap + 1"""
+	"""bases are each seen once; reverse walks the reverse complement"""
+	size = len(seq)
+	for start in range(0, max(size, 1), chunk_size):
+		end = min(size, start + chunk_size + overlap)
+		if reverse:
+			yield start, bytes(seq[size - end:size - start]).translate(COMP)[::-1]
+		else:
+			yield start, bytes(seq[start:end])
+
+
+class TwoBitSeq:
+	"""One memory-mapped sequence, slices decode only the bytes they cover"""
+
+	def __init__(self, mm, offset):
+		"""Raises struct.error or ValueError when the record runs past the file"""
+		self._mm = mm
+		size, n_count = struct.unpack_from('<II', mm, offset)
+		offset += 8
+		n_starts = struct.unpack_from(f'<{n_count}I', mm, offset)
+		n_sizes = struct.unpack_from(f'<{n_count}I', mm, offset + 4 * n_count)
+		offset += 8 * n_count
+		mask_count = struct.unpack_from('<I', mm, offset)[0]
+		offset += 4
+		mask_starts = struct.unpack_from(f'<{mask_count}I', mm, offset)
+		mask_sizes = struct.unpack_from(f'<{mask_count}I', mm, offset + 4 * mask_count)
+		offset += 8 * mask_count + 4
+		if offset + (size + 3) // 4 > len(mm):
+			raise ValueError("record runs past the end of the file")
+		self.size = size
+		self._dna = offset
+		self._n_starts = n_starts
+		self._n_ends = [s + n for s, n in zip(n_starts, n_sizes)]
+		self._mask_starts = mask_starts
+		self._mask_ends = [s + n for s, n in zip(mask_starts, mask_sizes)]
+
+	def __len__(self):
+		return self.size
+
+	def __getitem__(self, key):
+		if not isinstance(key, slice):
+			raise TypeError("TwoBitSeq only supports slicing")
+		start, end, step = key.indices(self.size)
+		if step != 1:
+			raise ValueError("TwoBitSeq slices must have step 1")
+		return self.fetch(start, end)
+
+	def __bytes__(self):
+		return self.fetch(0, self.size)
+
+	def fetch(self, start, end):
+		"""Decode bases start..end (0-based, end exclusive) as bytes"""
+		if end <= start:
+			return b''
+		first = start // 4
+		last = (end + 3) // 4
+		packed = self._mm[self._dna + first:self._dna + last]
+		seq = unpack_seq(packed)[start - first * 4:end - first * 4]
+		if not self._n_starts and not self._mask_starts:
+			return seq
+		seq = bytearray(seq)
+		i = bisect.bisect_right(self._n_ends, start)
+		while i < len(self._n_starts) and self._n_starts[i] < end:
+			a = max(self._n_starts[i], start) - start
+			b = min(self._n_ends[i], end) - start
+			seq[a:b] = b'N' * (b - a)
+			i += 1
+		i = bisect.bisect_right(self._mask_ends, start)
+		while i < len(self._mask_starts) and self._mask_starts[i] < end:
+			a = max(self._mask_starts[i], start) - start
+			b = min(self._mask_ends[i], end) - start
+			seq[a:b] = seq[a:b].lower()
+			i += 1
+		return bytes(seq)
+
+	def revcomp(self, start, end):
+		"""Reverse-complement of bases start..end"""
+		return self.fetch(start, end).translate(COMP)[::-1]
+
+
+class TwoBitFile:
+	"""Memory-mapped .2bit file, sequences are looked up by name"""
+
+	def __init__(self, filename):
+		try:
+			self._fp = open(filename, 'rb')
+			self._mm = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+		except Exception as e:
+			raise IOError(f"Error opening file {filename}: {e}") from e
+		self.filename = filename
+		try:
+			signature, version, count, _ = struct.unpack_from('<IIII', self._mm, 0)
+		except struct.error:
+			self.close()
+			raise ValueError(f"Error: Input file {filename} is truncated or not a .2bit file.")
+		if signature != SIGNATURE or version not in (0, 1):
+			self.close()
+			raise ValueError(f"Error: Input file {filename} is not a .2bit file.")
+		self.offsets = {}
+		pos = 16
+		try:
+			for _ in range(count):
+				name_size = self._mm[pos]
+				name = self._mm[pos + 1:pos + 1 + name_size].decode()
+				pos += 1 + name_size
+				if version == 0:
+					self.offsets[name] = struct.unpack_from('<I', self._mm, pos)[0]
+					pos += 4
+				else:
+					self.offsets[name] = struct.unpack_from('<Q', self._mm, pos)[0]
+					pos += 8
+		except (struct.error, IndexError, UnicodeDecodeError):
+			self.close()
+			raise ValueError(f"Error: Input file {filename} is truncated or not a .2bit file.")
+
+	def __getitem__(self, name):
+		try:
+			return TwoBitSeq(self._mm, self.offsets[name])
+		except (struct.error, ValueError):
+			raise ValueError(f"Error: Input file {self.filename} is truncated or not a .2bit file.")
+
+	def __iter__(self):
+		for name in self.offsets:
+			yield (name, self[name])
+
+	def close(self):
+		self._mm.close()
+		self._fp.close()
+
+
+def read_twobit(filename):
+	"""Iteratively read (name, TwoBitSeq) records from a .2bit file"""
+	twobit = TwoBitFile(filename)
+	try:
+		yield from twobit
+	finally:
+		twobit.close()
+
+
+def info_file(filename):
+	"""Sidecar holding GBFF header lines for a .2bit file"""
+	return filename + '.info'
+
+
+def read_twobit_gbff(filename):
+	"""Iteratively read (info, TwoBitSeq) records converted from GBFF"""
+	try:
+		with open(info_file(filename)) as fp:
+			infos = fp.read().split('//\n')[:-1]
+	except IOError as e:
+		raise IOError(f"Error opening file {info_file(filename)}: {e}") from e
+	for info, (name, seq) in zip(infos, read_twobit(filename)):
+		yield (info.splitlines(), seq)
+
+
+def convert_gbff(input_file, output_file):
+	"""Write GBFF sequences to .2bit and their header lines to the sidecar"""
+	try:
+		info_fp = open(info_file(output_file), 'w')
+	except IOError as e:
+		raise IOError(f"Error writing to output file {info_file(output_file)}: {e}") from e
+
+	def records():
+		for i, (info, seq) in enumerate(read_gbff(input_file)):
+			info_fp.write('\n'.join(info) + '\n//\n')
+			if info and info[0].startswith('LOCUS'):
+				yield (info[0].split()[1], seq)
+			else:
+				yield (f"seq{i + 1}", seq)
+
+	with info_fp:
+		try:
+			return write_twobit(records(), output_file)
+		except ValueError:
+			info_fp.close()
+			os.remove(info_file(output_file))
+			raise
+
+
+def main():
+	"""argparse statements"""
+	parser = argparse.ArgumentParser(
+		description='Convert FASTA or GBFF sequences to a 2-bit packed .2bit file.',
+		formatter_class=argparse.RawTextHelpFormatter)
+	parser.add_argument('input_file',
+						help=('Input FASTA or GBFF file\n'
+							  'Accept .fasta/.fa/.gbff and their .gz'))
+	parser.add_argument('-o', '--output',
+						help=('Output .2bit file\n'
+							  'GBFF header lines go to [output].info\n'
+							  'Default = [input_file_basename].2bit'))
+
+	args = parser.parse_args()
+
+	"""Input checks"""
+	if not os.path.exists(args.input_file):
+		sys.exit(f"Error: Input file {args.input_file} does not exist.")
+
+	base = args.input_file
+	if base.endswith('.gz'):
+		base = base[:-3]
+	base, ext = os.path.splitext(base)
+	if ext not in ('.fasta', '.fa', '.gbff'):
+		sys.exit("Error: Input file type error.\nFile type fasta/fa/gbff (.gz) expected.")
+
+	"""Format outfile name"""
+	if args.output:
+		output_file = args.output
+	else:
+		output_file = base + '.2bit'
+
+	"""Code body"""
+	try:
+		if ext == '.gbff':
+			names = convert_gbff(args.input_file, output_file)
+		else:
+			names = write_twobit(read_fasta(args.input_file), output_file)
+		print(f"Wrote {len(names)} sequences to {output_file}")
+	except (IOError, ValueError) as e:
+		sys.exit(str(e))
+
+
+if __name__ == '__main__':
+	main()